@@ -3,7 +3,9 @@ Admin panel and controls for Telegram Protection Bot
 """
 
 import logging
-from typing import Dict, Any
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Dict, Any, Tuple
 from pyrogram import Client
 from pyrogram.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from database import Database
@@ -11,42 +13,34 @@ from filters import ContentFilter
 
 logger = logging.getLogger(__name__)
 
-
-class AdminPanel:
-    """Admin panel for bot configuration"""
-
-    def __init__(self, client: Client, db: Database,
-                 content_filter: ContentFilter):
-        self.client = client
-        self.db = db
-        self.content_filter = content_filter
-
-    async def show_main_menu(self, message: Message):
-        """Show main admin menu"""
-        try:
-            keyboard = InlineKeyboardMarkup(
-                [[
-                    InlineKeyboardButton("🛡️ Security Settings",
-                                         callback_data="security_settings"),
-                    InlineKeyboardButton("📊 Statistics",
-                                         callback_data="statistics")
-                ],
-                 [
-                     InlineKeyboardButton("📋 View Logs",
-                                          callback_data="view_logs"),
-                     InlineKeyboardButton("🔧 Advanced",
-                                          callback_data="advanced_settings")
-                 ],
-                 [
-                     InlineKeyboardButton("📝 Keywords",
-                                          callback_data="manage_keywords"),
-                     InlineKeyboardButton("👥 Whitelist",
-                                          callback_data="manage_whitelist")
-                 ],
-                 [InlineKeyboardButton("❌ Close",
-                                       callback_data="close_menu")]])
-
-            text = """
+# Toggle callback data -> group_settings column
+_TOGGLE_SETTING_MAP = MappingProxyType({
+    "toggle_text_filter": "text_filter_enabled",
+    "toggle_edit_monitor": "edit_monitor_enabled",
+    "toggle_media_filter": "media_filter_enabled",
+    "toggle_anti_flood": "anti_flood_enabled",
+    "toggle_auto_delete": "auto_delete_enabled"
+})
+
+# Static menus are built once at import time and shared by every render
+_MAIN_MENU_KEYBOARD = InlineKeyboardMarkup(
+    [[
+        InlineKeyboardButton("🛡️ Security Settings",
+                             callback_data="security_settings"),
+        InlineKeyboardButton("📊 Statistics", callback_data="statistics")
+    ],
+     [
+         InlineKeyboardButton("📋 View Logs", callback_data="view_logs"),
+         InlineKeyboardButton("🔧 Advanced",
+                              callback_data="advanced_settings")
+     ],
+     [
+         InlineKeyboardButton("📝 Keywords", callback_data="manage_keywords"),
+         InlineKeyboardButton("👥 Whitelist",
+                              callback_data="manage_whitelist")
+     ], [InlineKeyboardButton("❌ Close", callback_data="close_menu")]])
+
+_MAIN_MENU_TEXT = """
 🛡️ **Admin Panel**
 
 Choose an option to configure the bot:
@@ -57,85 +51,44 @@ Choose an option to configure the bot:
 • **Advanced**: Configure thresholds and limits
 • **Keywords**: Manage banned keywords
 • **Whitelist**: Manage whitelisted users
-            """
+"""
 
-            await message.reply(text, reply_markup=keyboard)
+_BACK_KEYBOARD = InlineKeyboardMarkup([[
+    InlineKeyboardButton("⬅️ Back", callback_data="back_to_main")
+]])
 
-        except Exception as e:
-            logger.error(f"Error showing main menu: {e}")
+_KEYWORDS_BACK_KEYBOARD = InlineKeyboardMarkup([[
+    InlineKeyboardButton("⬅️ Back", callback_data="manage_keywords")
+]])
 
-    async def handle_callback(self, callback_query: CallbackQuery):
-        """Handle callback queries from admin panel"""
-        try:
-            data = callback_query.data
-
-            if data == "security_settings":
-                await self.show_security_settings(callback_query)
-            elif data == "statistics":
-                await self.show_statistics(callback_query)
-            elif data == "view_logs":
-                await self.show_logs(callback_query)
-            elif data == "advanced_settings":
-                await self.show_advanced_settings(callback_query)
-            elif data == "manage_keywords":
-                await self.show_keyword_management(callback_query)
-            elif data == "manage_whitelist":
-                await self.show_whitelist_management(callback_query)
-            elif data == "close_menu":
-                await callback_query.message.delete()
-            elif data.startswith("toggle_"):
-                await self.handle_toggle(callback_query, data)
-            elif data.startswith("keyword_"):
-                await self.handle_keyword_action(callback_query, data)
-            elif data == "back_to_main":
-                await self.show_main_menu_edit(callback_query)
+# (label, group_settings column, callback data) for each security toggle
+_SECURITY_TOGGLES = (
+    ("Text Filter", "text_filter_enabled", "toggle_text_filter"),
+    ("Edit Monitor", "edit_monitor_enabled", "toggle_edit_monitor"),
+    ("Media Filter", "media_filter_enabled", "toggle_media_filter"),
+    ("Anti-Flood", "anti_flood_enabled", "toggle_anti_flood"),
+    ("Auto Delete", "auto_delete_enabled", "toggle_auto_delete"),
+)
 
-            await callback_query.answer()
 
-        except Exception as e:
-            logger.error(f"Error handling callback: {e}")
-            await callback_query.answer("An error occurred. Please try again.",
-                                        show_alert=True)
+@lru_cache(maxsize=2 ** len(_SECURITY_TOGGLES))
+def _security_keyboard_for(states: Tuple[bool, ...]) -> InlineKeyboardMarkup:
+    """Build the security settings keyboard for one combination of toggles"""
+    rows = [[
+        InlineKeyboardButton(f"{label}: {'✅' if enabled else '❌'}",
+                             callback_data=callback_data)
+    ] for (label, _, callback_data), enabled in zip(_SECURITY_TOGGLES, states)]
+    rows.append([InlineKeyboardButton("⬅️ Back", callback_data="back_to_main")])
+    return InlineKeyboardMarkup(rows)
 
-    async def show_security_settings(self, callback_query: CallbackQuery):
-        """Show security settings menu"""
-        try:
-            chat_id = callback_query.message.chat.id
-            settings = await self.db.get_group_settings(chat_id)
 
-            keyboard = InlineKeyboardMarkup([
-                [
-                    InlineKeyboardButton(
-                        f"Text Filter: {'✅' if settings.get('text_filter_enabled') else '❌'}",
-                        callback_data="toggle_text_filter")
-                ],
-                [
-                    InlineKeyboardButton(
-                        f"Edit Monitor: {'✅' if settings.get('edit_monitor_enabled') else '❌'}",
-                        callback_data="toggle_edit_monitor")
-                ],
-                [
-                    InlineKeyboardButton(
-                        f"Media Filter: {'✅' if settings.get('media_filter_enabled') else '❌'}",
-                        callback_data="toggle_media_filter")
-                ],
-                [
-                    InlineKeyboardButton(
-                        f"Anti-Flood: {'✅' if settings.get('anti_flood_enabled') else '❌'}",
-                        callback_data="toggle_anti_flood")
-                ],
-                [
-                    InlineKeyboardButton(
-                        f"Auto Delete: {'✅' if settings.get('auto_delete_enabled') else '❌'}",
-                        callback_data="toggle_auto_delete")
-                ],
-                [
-                    InlineKeyboardButton("⬅️ Back",
-                                         callback_data="back_to_main")
-                ]
-            ])
+def _security_keyboard(settings: Dict[str, Any]) -> InlineKeyboardMarkup:
+    """Get the shared security settings keyboard matching the given settings"""
+    return _security_keyboard_for(
+        tuple(bool(settings.get(key)) for _, key, _ in _SECURITY_TOGGLES))
+
 
-            text = """
+_SECURITY_SETTINGS_TEXT = """
 🛡️ **Security Settings**
 
 Toggle protection features on/off:
@@ -145,35 +98,140 @@ Toggle protection features on/off:
 • **Media Filter**: Scan media files for suspicious content
 • **Anti-Flood**: Prevent message flooding
 • **Auto Delete**: Automatically delete violations
-            """
+"""
 
-            await callback_query.message.edit_text(text, reply_markup=keyboard)
+_KEYWORD_MANAGEMENT_TEXT = """
+📝 **Keyword Management**
 
-        except Exception as e:
-            logger.error(f"Error showing security settings: {e}")
+Click on a category to view and manage keywords:
+
+**Categories:**
+• Hate Speech
+• Violence
+• Drugs
+• Adult Content
+• Hindi Offensive
+
+**Note:** Use `/add_keyword <category> <keyword>` to add new keywords
+Use `/remove_keyword <category> <keyword>` to remove keywords
+"""
+
+_WHITELIST_MANAGEMENT_TEXT = """
+👥 **Whitelist Management**
+
+**Whitelisted Users:**
+Currently, all group admins are automatically whitelisted.
+
+**Commands:**
+• `/whitelist @username` - Add user to whitelist
+• `/unwhitelist @username` - Remove user from whitelist
+• `/whitelist_list` - View all whitelisted users
+
+**Note:** Whitelisted users bypass all content filters but edit monitoring may still apply.
+"""
+
+
+class AdminPanel:
+    """Admin panel for bot configuration"""
+
+    __slots__ = ("client", "db", "content_filter",
+                 "callback_handlers", "prefix_handlers")
+
+    def __init__(self, client: Client, db: Database,
+                 content_filter: ContentFilter):
+        self.client = client
+        self.db = db
+        self.content_filter = content_filter
+
+        # Callback dispatch tables: exact matches first, then prefixes
+        self.callback_handlers = {
+            "security_settings": self.show_security_settings,
+            "statistics": self.show_statistics,
+            "view_logs": self.show_logs,
+            "advanced_settings": self.show_advanced_settings,
+            "manage_keywords": self.show_keyword_management,
+            "manage_whitelist": self.show_whitelist_management,
+            "close_menu": self._close_menu,
+            "back_to_main": self._back_to_main,
+        }
+        self.prefix_handlers = (
+            ("toggle_", self.handle_toggle),
+            ("keyword_", self.handle_keyword_action),
+        )
+
+    async def show_main_menu(self, message: Message):
+        """Show main admin menu"""
+        await self._render_main_menu(message, edit=False)
+
+    async def _render_main_menu(self, message: Message, edit: bool):
+        """Send the main menu as a reply or by editing the given message"""
+        try:
+            if edit:
+                await message.edit_text(_MAIN_MENU_TEXT,
+                                        reply_markup=_MAIN_MENU_KEYBOARD)
+            else:
+                await message.reply(_MAIN_MENU_TEXT,
+                                    reply_markup=_MAIN_MENU_KEYBOARD)
+        except Exception:
+            logger.exception("Error showing main menu")
+
+    async def handle_callback(self, callback_query: CallbackQuery):
+        """Handle callback queries from admin panel"""
+        data = callback_query.data
+        handler = self.callback_handlers.get(data)
 
-    async def show_statistics(self, callback_query: CallbackQuery):
-        """Show group statistics"""
         try:
+            if handler:
+                await handler(callback_query)
+            else:
+                for prefix, prefix_handler in self.prefix_handlers:
+                    if data.startswith(prefix):
+                        await prefix_handler(callback_query, data)
+                        break
+
+            await callback_query.answer()
+
+        except Exception:
+            logger.exception("Error handling callback")
+            await callback_query.answer("An error occurred. Please try again.",
+                                        show_alert=True)
+
+    async def _close_menu(self, callback_query: CallbackQuery):
+        """Close the admin panel"""
+        await callback_query.message.delete()
+
+    async def _back_to_main(self, callback_query: CallbackQuery):
+        """Return to the main menu"""
+        await self._render_main_menu(callback_query.message, edit=True)
+
+    async def show_security_settings(self, callback_query: CallbackQuery,
+                                     settings: Dict[str, Any] = None):
+        """Show security settings menu"""
+        if settings is None:
             chat_id = callback_query.message.chat.id
-            logs = await self.db.get_moderation_logs(chat_id, 100)
-
-            # Calculate statistics
-            total_actions = len(logs)
-            banned_content = len(
-                [l for l in logs if l['action'] == 'Banned content detected'])
-            spam_detected = len(
-                [l for l in logs if l['action'] == 'Spam detected'])
-            floods_detected = len(
-                [l for l in logs if l['action'] == 'Flood detected'])
-            edits_deleted = len(
-                [l for l in logs if l['action'] == 'Message edited'])
-
-            keyboard = InlineKeyboardMarkup([[
-                InlineKeyboardButton("⬅️ Back", callback_data="back_to_main")
-            ]])
-
-            text = f"""
+            settings = await self.db.get_group_settings(chat_id)
+
+        keyboard = _security_keyboard(settings)
+
+        try:
+            await callback_query.message.edit_text(_SECURITY_SETTINGS_TEXT,
+                                                   reply_markup=keyboard)
+        except Exception:
+            logger.exception("Error showing security settings")
+
+    async def show_statistics(self, callback_query: CallbackQuery):
+        """Show group statistics"""
+        chat_id = callback_query.message.chat.id
+        counts = await self.db.get_recent_action_counts(chat_id, 100)
+
+        # Calculate statistics
+        total_actions = sum(counts.values())
+        banned_content = counts.get('Banned content detected', 0)
+        spam_detected = counts.get('Spam detected', 0)
+        floods_detected = counts.get('Flood detected', 0)
+        edits_deleted = counts.get('Message edited', 0)
+
+        text = f"""
 📊 **Group Statistics**
 
 **Recent Activity (Last 100 actions):**
@@ -186,57 +244,55 @@ Toggle protection features on/off:
 **Protection Efficiency:**
 • Content Filtered: {banned_content + spam_detected}
 • Behavior Violations: {floods_detected + edits_deleted}
-            """
+        """
 
-            await callback_query.message.edit_text(text, reply_markup=keyboard)
-
-        except Exception as e:
-            logger.error(f"Error showing statistics: {e}")
+        try:
+            await callback_query.message.edit_text(text,
+                                                   reply_markup=_BACK_KEYBOARD)
+        except Exception:
+            logger.exception("Error showing statistics")
 
     async def show_logs(self, callback_query: CallbackQuery):
         """Show recent moderation logs"""
-        try:
-            chat_id = callback_query.message.chat.id
-            logs = await self.db.get_moderation_logs(chat_id, 10)
+        chat_id = callback_query.message.chat.id
+        logs = await self.db.get_recent_actions(chat_id, 10)
 
-            keyboard = InlineKeyboardMarkup([[
-                InlineKeyboardButton("⬅️ Back", callback_data="back_to_main")
-            ]])
+        if not logs:
+            text = "📋 **Recent Logs**\n\nNo moderation actions found."
+        else:
+            parts = ["📋 **Recent Logs**\n\n"]
+            size = len(parts[0])
 
-            if not logs:
-                text = "📋 **Recent Logs**\n\nNo moderation actions found."
-            else:
-                text = "📋 **Recent Logs**\n\n"
+            for log in logs:
+                user_name = log.get('user_name', 'Unknown')
+                action = log['action']
+                timestamp = log['timestamp']
 
-                for log in logs:
-                    user_name = log.get('user_name', 'Unknown')
-                    action = log['action']
-                    timestamp = log['timestamp']
+                entry = (f"• {action}\n"
+                         f"  User: {user_name}\n"
+                         f"  Time: {timestamp}\n\n")
 
-                    text += f"• {action}\n"
-                    text += f"  User: {user_name}\n"
-                    text += f"  Time: {timestamp}\n\n"
+                if size + len(entry) > 3000:  # Telegram message limit
+                    parts.append("... (truncated)\n")
+                    break
 
-                    if len(text) > 3000:  # Telegram message limit
-                        text += "... (truncated)\n"
-                        break
+                parts.append(entry)
+                size += len(entry)
 
-            await callback_query.message.edit_text(text, reply_markup=keyboard)
+            text = "".join(parts)
 
-        except Exception as e:
-            logger.error(f"Error showing logs: {e}")
+        try:
+            await callback_query.message.edit_text(text,
+                                                   reply_markup=_BACK_KEYBOARD)
+        except Exception:
+            logger.exception("Error showing logs")
 
     async def show_advanced_settings(self, callback_query: CallbackQuery):
         """Show advanced settings"""
-        try:
-            chat_id = callback_query.message.chat.id
-            settings = await self.db.get_group_settings(chat_id)
+        chat_id = callback_query.message.chat.id
+        settings = await self.db.get_group_settings(chat_id)
 
-            keyboard = InlineKeyboardMarkup([[
-                InlineKeyboardButton("⬅️ Back", callback_data="back_to_main")
-            ]])
-
-            text = f"""
+        text = f"""
 🔧 **Advanced Settings**
 
 **Current Configuration:**
@@ -251,122 +307,73 @@ Toggle protection features on/off:
 • Image Analysis: 🚧 Coming Soon
 • Text Analysis: ✅ Active
 • Media Scanning: 🚧 Coming Soon
-            """
-
-            await callback_query.message.edit_text(text, reply_markup=keyboard)
+        """
 
-        except Exception as e:
-            logger.error(f"Error showing advanced settings: {e}")
+        try:
+            await callback_query.message.edit_text(text,
+                                                   reply_markup=_BACK_KEYBOARD)
+        except Exception:
+            logger.exception("Error showing advanced settings")
 
     async def show_keyword_management(self, callback_query: CallbackQuery):
         """Show keyword management menu"""
-        try:
-            categories = self.content_filter.get_keyword_categories()
-
-            keyboard_buttons = []
-            for category in categories:
-                keyword_count = len(
-                    self.content_filter.get_keywords_by_category(category))
-                keyboard_buttons.append([
-                    InlineKeyboardButton(
-                        f"{category.replace('_', ' ').title()} ({keyword_count})",
-                        callback_data=f"keyword_view_{category}")
-                ])
-
+        keyboard_buttons = []
+        for category, keyword_count in (
+                self.content_filter.get_category_snapshot()):
             keyboard_buttons.append([
-                InlineKeyboardButton("⬅️ Back", callback_data="back_to_main")
+                InlineKeyboardButton(
+                    f"{category.replace('_', ' ').title()} ({keyword_count})",
+                    callback_data=f"keyword_view_{category}")
             ])
-            keyboard = InlineKeyboardMarkup(keyboard_buttons)
-
-            text = """
-📝 **Keyword Management**
-
-Click on a category to view and manage keywords:
-
-**Categories:**
-• Hate Speech
-• Violence
-• Drugs
-• Adult Content
-• Hindi Offensive
 
-**Note:** Use `/add_keyword <category> <keyword>` to add new keywords
-Use `/remove_keyword <category> <keyword>` to remove keywords
-            """
+        keyboard_buttons.append([
+            InlineKeyboardButton("⬅️ Back", callback_data="back_to_main")
+        ])
+        keyboard = InlineKeyboardMarkup(keyboard_buttons)
 
-            await callback_query.message.edit_text(text, reply_markup=keyboard)
-
-        except Exception as e:
-            logger.error(f"Error showing keyword management: {e}")
+        try:
+            await callback_query.message.edit_text(_KEYWORD_MANAGEMENT_TEXT,
+                                                   reply_markup=keyboard)
+        except Exception:
+            logger.exception("Error showing keyword management")
 
     async def show_whitelist_management(self, callback_query: CallbackQuery):
         """Show whitelist management menu"""
         try:
-            keyboard = InlineKeyboardMarkup([[
-                InlineKeyboardButton("⬅️ Back", callback_data="back_to_main")
-            ]])
-
-            text = """
-👥 **Whitelist Management**
-
-**Whitelisted Users:**
-Currently, all group admins are automatically whitelisted.
-
-**Commands:**
-• `/whitelist @username` - Add user to whitelist
-• `/unwhitelist @username` - Remove user from whitelist
-• `/whitelist_list` - View all whitelisted users
-
-**Note:** Whitelisted users bypass all content filters but edit monitoring may still apply.
-            """
-
-            await callback_query.message.edit_text(text, reply_markup=keyboard)
-
-        except Exception as e:
-            logger.error(f"Error showing whitelist management: {e}")
+            await callback_query.message.edit_text(
+                _WHITELIST_MANAGEMENT_TEXT, reply_markup=_BACK_KEYBOARD)
+        except Exception:
+            logger.exception("Error showing whitelist management")
 
     async def handle_toggle(self, callback_query: CallbackQuery, data: str):
         """Handle toggle switches"""
-        try:
-            chat_id = callback_query.message.chat.id
-            settings = await self.db.get_group_settings(chat_id)
-
-            setting_map = {
-                "toggle_text_filter": "text_filter_enabled",
-                "toggle_edit_monitor": "edit_monitor_enabled",
-                "toggle_media_filter": "media_filter_enabled",
-                "toggle_anti_flood": "anti_flood_enabled",
-                "toggle_auto_delete": "auto_delete_enabled"
-            }
+        setting_key = _TOGGLE_SETTING_MAP.get(data)
+        if not setting_key:
+            return
 
-            if data in setting_map:
-                setting_key = setting_map[data]
-                current_value = settings.get(setting_key, True)
-                settings[setting_key] = not current_value
+        chat_id = callback_query.message.chat.id
+        settings = await self.db.toggle_group_setting(chat_id, setting_key)
 
-                await self.db.update_group_settings(chat_id, settings)
+        if not settings:
+            return
 
-                # Refresh the security settings menu
-                await self.show_security_settings(callback_query)
-
-        except Exception as e:
-            logger.error(f"Error handling toggle: {e}")
+        # Only the toggle labels change, so refresh just the keyboard
+        try:
+            await callback_query.message.edit_reply_markup(
+                _security_keyboard(settings))
+        except Exception:
+            logger.exception("Error refreshing security settings")
 
     async def handle_keyword_action(self, callback_query: CallbackQuery,
                                     data: str):
         """Handle keyword-related actions"""
-        try:
-            if data.startswith("keyword_view_"):
-                category = data.replace("keyword_view_", "")
-                keywords = self.content_filter.get_keywords_by_category(
-                    category)
+        if not data.startswith("keyword_view_"):
+            return
 
-                keyboard = InlineKeyboardMarkup([[
-                    InlineKeyboardButton("⬅️ Back",
-                                         callback_data="manage_keywords")
-                ]])
+        category = data[len("keyword_view_"):]
+        keywords = self.content_filter.get_keywords_by_category(category)
 
-                text = f"""
+        text = f"""
 📝 **{category.replace('_', ' ').title()} Keywords**
 
 **Current Keywords:**
@@ -375,53 +382,10 @@ Currently, all group admins are automatically whitelisted.
 **Management:**
 • Use `/add_keyword {category} <keyword>` to add
 • Use `/remove_keyword {category} <keyword>` to remove
-                """
-
-                await callback_query.message.edit_text(text,
-                                                       reply_markup=keyboard)
-
-        except Exception as e:
-            logger.error(f"Error handling keyword action: {e}")
+        """
 
-    async def show_main_menu_edit(self, callback_query: CallbackQuery):
-        """Show main menu by editing current message"""
         try:
-            keyboard = InlineKeyboardMarkup(
-                [[
-                    InlineKeyboardButton("🛡️ Security Settings",
-                                         callback_data="security_settings"),
-                    InlineKeyboardButton("📊 Statistics",
-                                         callback_data="statistics")
-                ],
-                 [
-                     InlineKeyboardButton("📋 View Logs",
-                                          callback_data="view_logs"),
-                     InlineKeyboardButton("🔧 Advanced",
-                                          callback_data="advanced_settings")
-                 ],
-                 [
-                     InlineKeyboardButton("📝 Keywords",
-                                          callback_data="manage_keywords"),
-                     InlineKeyboardButton("👥 Whitelist",
-                                          callback_data="manage_whitelist")
-                 ],
-                 [InlineKeyboardButton("❌ Close",
-                                       callback_data="close_menu")]])
-
-            text = """
-🛡️ **Admin Panel**
-
-Choose an option to configure the bot:
-
-• **Security Settings**: Toggle protection features
-• **Statistics**: View group statistics
-• **View Logs**: Check recent moderation actions
-• **Advanced**: Configure thresholds and limits
-• **Keywords**: Manage banned keywords
-• **Whitelist**: Manage whitelisted users
-            """
-
-            await callback_query.message.edit_text(text, reply_markup=keyboard)
-
-        except Exception as e:
-            logger.error(f"Error showing main menu edit: {e}")
+            await callback_query.message.edit_text(
+                text, reply_markup=_KEYWORDS_BACK_KEYBOARD)
+        except Exception:
+            logger.exception("Error handling keyword action")
@@ -6,18 +6,145 @@ Includes anti-link, anti-flood, anti-fake, anti-vpn protection
 import re
 import asyncio
 import logging
-import hashlib
+import time
+from collections import OrderedDict, deque
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Deque, Dict, List, Optional, Set, Tuple
 from dataclasses import dataclass
-from urllib.parse import urlparse
 from pyrogram.client import Client
-from pyrogram.types import Message, User
+from pyrogram.types import Message
 from database import Database
-from utils import safe_ban_user, safe_restrict_user, format_user_mention
+from utils import DelayedDeleter, safe_ban_user, safe_restrict_user, format_user_mention
 
 logger = logging.getLogger(__name__)
 
+# Patterns are compiled once at import instead of on every message
+_LINK_COUNT_RE = re.compile(r'http[s]?://\S+|www\.\S+|\S+\.\S+/\S+')
+# Captures the host (netloc) alongside the full URL so it needs no separate parse;
+# the lookaheads keep the spans equal to http[s]?://\S+|www\.\S+, so a bare
+# "http://" or "www." is not a link
+_URL_EXTRACT_RE = re.compile(r'(?:http[s]?://(?=\S)|(?=www\.\S))(?P<host>[^\s/?#]*)\S*')
+# Deletes ASCII digits; the length difference after translate() is the digit count
+_STRIP_DIGITS = str.maketrans('', '', '0123456789')
+_RANDOM_USERNAME_RE = re.compile(r'[a-z]{3,}\d{3,}')
+
+# Suspicious patterns are folded into one alternation so each input is
+# scanned once instead of once per pattern
+_SUSPICIOUS_URL_RE = re.compile('|'.join([
+    r'[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}',  # IP addresses
+    r'[a-z]{20,}\.com',  # Very long domain names
+    r'telegram.*bot',  # Fake telegram bot URLs
+    r'crypto.*giveaway',  # Crypto giveaway scams
+    r'free.*money',  # Free money scams
+]))
+
+_SUSPICIOUS_USERNAME_RE = re.compile('|'.join([
+    r'[a-z]+\d{5,}',  # letters followed by many numbers
+    r'\d+[a-z]+\d+',  # numbers-letters-numbers
+    r'(?:test|temp|fake|spam)\d+',  # common fake patterns
+    r'[a-z]{1,3}\d{8,}',  # very short letters + many numbers
+]))
+
+# Known link shorteners; also treated as phishing domains by default
+_SHORTENERS = frozenset({
+    'bit.ly', 'tinyurl.com', 'short.link', 'rebrand.ly',
+    'ow.ly', 'buff.ly', 't.co', 'goo.gl', 'tiny.cc'
+})
+
+_DISPOSABLE_DOMAINS = frozenset({
+    '10minutemail.com', 'guerrillamail.com', 'mailinator.com',
+    'tempmail.org', 'temp-mail.org', 'throwaway.email',
+    'yopmail.com', 'mohmal.com', 'sharklasers.com'
+})
+
+# Brand domains commonly impersonated by one-character typos
+_BRANDS = frozenset({
+    'telegram.org', 'telegram.me', 'google.com', 'youtube.com',
+    'paypal.com', 'binance.com', 'coinbase.com', 'metamask.io',
+    'apple.com', 'microsoft.com', 'instagram.com', 'facebook.com'
+})
+
+# Brand labels bucketed by (TLD, label length), so a domain is only compared
+# with brands under its own TLD whose label is within one character of its own;
+# apple.co or google.cm are the brands' own domains, not typos of apple.com
+_BRANDS_BY_LEN: Dict[Tuple[str, int], Tuple[str, ...]] = {}
+for _brand in sorted(_BRANDS):
+    _label, _, _tld = _brand.partition('.')
+    _BRANDS_BY_LEN[(_tld, len(_label))] = _BRANDS_BY_LEN.get((_tld, len(_label)), ()) + (_label,)
+del _brand, _label, _tld
+
+# Added to the link confidence per typosquat hit; on its own it stays below
+# the link check threshold, so a lookalike never decides a ban by itself
+TYPOSQUAT_WEIGHT = 0.3
+
+# Seconds between sweeps of expired user behavior and profile verdicts
+CLEANUP_INTERVAL = 10 * 60
+
+def _within_one_edit(a: str, b: str) -> bool:
+    """Check if a differs from b by exactly one insert, delete or substitution"""
+    if len(a) < len(b):
+        a, b = b, a
+    if len(a) - len(b) > 1:
+        return False
+    
+    # Skip the common prefix, then compare what is left after the first difference
+    i = 0
+    while i < len(b) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return i < len(a) and a[i + 1:] == b[i + 1:]
+    return a[i + 1:] == b[i:]
+
+def _typosquat_target(domain: str) -> Optional[str]:
+    """Return the brand domain that domain imitates by a single typo"""
+    apex = '.'.join(domain.rsplit('.', 2)[-2:])
+    if apex in _BRANDS:
+        return None
+    
+    # Only the second-level label is compared, against brands sharing the TLD
+    label, _, tld = apex.partition('.')
+    size = len(label)
+    for length in (size - 1, size, size + 1):
+        for brand in _BRANDS_BY_LEN.get((tld, length), ()):
+            if _within_one_edit(label, brand):
+                return f"{brand}.{tld}"
+    return None
+
+def _normalize_host(host: str) -> str:
+    """Strip credentials, port and trailing dot from a URL host"""
+    host = host.rpartition('@')[2]
+    if host.startswith('['):
+        host = host[:host.find(']') + 1]
+    else:
+        host = host.partition(':')[0]
+    return host.rstrip('.').lower()
+
+# Domain flags combined in AntiSpamSystem.domain_flags
+_PHISHING_DOMAIN = 1
+_SHORTENER_DOMAIN = 2
+
+def _domain_flags(host: str, index: Dict[str, int]) -> int:
+    """Combine the flags of host and every parent domain found in index"""
+    flags = 0
+    while host:
+        flags |= index.get(host, 0)
+        host = host.partition('.')[2]
+    return flags
+
+# Per-message checks in evaluation order as (reason, confidence, action);
+# bit i of a check mask marks check i, and the last hit decides the action
+_FLOOD, _REPETITIVE, _LINKS, _NEW_USER, _FAKE_USER, _SUSPICIOUS_USERNAME = (
+    1 << i for i in range(6)
+)
+_CHECKS = (
+    ("Flood detected", 0.8, 'mute'),
+    ("Repetitive content", 0.6, 'warn'),
+    (None, None, 'ban'),  # link reasons and confidence come from _check_links
+    ("Suspicious new user behavior", 0.5, 'warn'),
+    ("Fake user indicators", 0.7, 'ban'),
+    ("Suspicious username pattern", 0.4, 'warn'),
+)
+
 @dataclass
 class SpamDetection:
     """Spam detection result"""
@@ -26,131 +153,152 @@ class SpamDetection:
     reasons: List[str]
     action: str  # 'warn', 'mute', 'ban', 'delete'
 
-@dataclass
+@dataclass(slots=True)
 class UserBehavior:
-    """User behavior tracking"""
-    user_id: int
-    message_count: int
-    last_message_time: datetime
-    similar_messages: int
+    """User behavior tracking, slotted since one is kept per active user"""
+    message_times: Deque[float]  # send times within the flood window, oldest first
+    last_message_time: float  # epoch seconds
     link_count: int
     media_count: int
-    join_time: datetime
+    join_time: float  # epoch seconds
     warnings: int
+    
+    @property
+    def message_count(self) -> int:
+        """Messages sent within the flood window"""
+        return len(self.message_times)
 
 class AntiSpamSystem:
     """Advanced anti-spam protection system"""
     
-    def __init__(self, client: Client, db: Database):
+    def __init__(self, client: Client, db: Database, deleter: Optional[DelayedDeleter] = None):
         self.client = client
         self.db = db
-        self.user_behavior: Dict[int, UserBehavior] = {}
-        self.message_hashes: Dict[int, Set[str]] = {}  # chat_id: set of message hashes
-        self.disposable_domains = set()
-        self.phishing_domains = set()
+        # Batched delayed deletion of notices, usually shared with the handlers
+        self.deleter = deleter or DelayedDeleter(client)
+        # Kept ordered by last_message_time, oldest first, so cleanup only touches expired users
+        self.user_behavior: OrderedDict[int, UserBehavior] = OrderedDict()
+        # chat_id: (recent message hashes in arrival order, same hashes as a set)
+        self.message_hashes: Dict[int, Tuple[Deque[int], Set[int]]] = {}
+        self.disposable_domains: frozenset = frozenset()
+        self.phishing_domains: frozenset = frozenset()
         self.vpn_ips = set()
+        # Blocklisted domain -> flags, so each link host is looked up once
+        self.domain_flags: Dict[str, int] = {}
+        self._index_domains()
         
         # Spam detection thresholds
         self.flood_threshold = 5  # messages per minute
+        self.flood_window = 60  # seconds covered by the flood sliding window
         self.similar_message_threshold = 3  # similar messages
         self.link_threshold = 2  # links per message
+        self.message_hash_limit = 100  # recent message hashes kept per chat
         self.new_user_restriction_hours = 24  # hours to restrict new users
+        self.profile_verdict_ttl = 600  # seconds a profile check result is reused
+        
+        # user_id: (expiry, (username, first_name, has_photo), check mask)
+        self.profile_verdicts: Dict[int, Tuple[float, Tuple, int]] = {}
         
         # Initialize detection databases
         asyncio.create_task(self._load_spam_databases())
+        
+        # Expired per-user state is swept periodically so it cannot grow without bound
+        self.cleanup_task = asyncio.create_task(self._cleanup_loop())
     
     async def _load_spam_databases(self):
         """Load spam databases (disposable emails, phishing domains, VPN IPs)"""
         try:
             # Load disposable email domains
-            self.disposable_domains = {
-                '10minutemail.com', 'guerrillamail.com', 'mailinator.com',
-                'tempmail.org', 'temp-mail.org', 'throwaway.email',
-                'yopmail.com', 'mohmal.com', 'sharklasers.com'
-            }
+            self.disposable_domains = _DISPOSABLE_DOMAINS
             
             # Load known phishing domains
-            self.phishing_domains = {
-                'bit.ly', 'tinyurl.com', 'short.link', 'rebrand.ly',
-                'ow.ly', 'buff.ly', 't.co', 'goo.gl'
-            }
+            self.phishing_domains = _SHORTENERS
+            self._index_domains()
             
             logger.info("Spam databases loaded successfully")
             
         except Exception as e:
             logger.error(f"Failed to load spam databases: {e}")
     
+    def _index_domains(self):
+        """Rebuild the domain flag index from the loaded domain lists"""
+        domain_flags = dict.fromkeys(_SHORTENERS, _SHORTENER_DOMAIN)
+        for domain in self.phishing_domains:
+            domain_flags[domain] = domain_flags.get(domain, 0) | _PHISHING_DOMAIN
+        self.domain_flags = domain_flags
+    
     async def analyze_message(self, message: Message) -> SpamDetection:
         """Analyze message for spam indicators"""
-        user_id = message.from_user.id
+        # Read every message and user feature once up front
+        user = message.from_user
+        user_id = user.id
+        username = user.username
         chat_id = message.chat.id
+        text = message.text or message.caption or ""
         
         # Update user behavior
-        await self._update_user_behavior(message)
+        self._update_user_behavior(user_id, text, bool(message.media))
         
-        reasons = []
-        confidence = 0.0
-        is_spam = False
-        action = 'none'
+        mask = 0
         
         # Check flood protection
-        if await self._check_flood(user_id, chat_id):
-            reasons.append("Flood detected")
-            confidence += 0.8
-            action = 'mute'
+        if self._check_flood(user_id, chat_id):
+            mask |= _FLOOD
         
         # Check similar messages
-        if await self._check_similar_messages(message):
-            reasons.append("Repetitive content")
-            confidence += 0.6
-            action = 'warn'
+        if self._check_similar_messages(chat_id, user_id, text):
+            mask |= _REPETITIVE
         
         # Check links
-        link_spam = await self._check_links(message.text or message.caption or "")
+        link_spam = self._check_links(text)
         if link_spam[0]:
-            reasons.extend(link_spam[1])
-            confidence += link_spam[2]
-            action = 'ban'
+            mask |= _LINKS
         
         # Check new user behavior
-        if await self._check_new_user_spam(message):
-            reasons.append("Suspicious new user behavior")
-            confidence += 0.5
-            action = 'warn'
+        if self._check_new_user_spam(user_id):
+            mask |= _NEW_USER
         
-        # Check fake user indicators
-        if await self._check_fake_user(message.from_user):
-            reasons.append("Fake user indicators")
-            confidence += 0.7
-            action = 'ban'
+        # Check fake user indicators and username patterns
+        mask |= self._check_profile(user_id, username, user.first_name, bool(user.photo))
         
-        # Check username patterns
-        if await self._check_suspicious_username(message.from_user.username):
-            reasons.append("Suspicious username pattern")
-            confidence += 0.4
-            action = 'warn'
+        if not mask:
+            return SpamDetection(is_spam=False, confidence=0.0, reasons=[], action='none')
+        
+        # Sum in check order so totals match the previous accumulation exactly
+        confidence = 0.0
+        for i, (_, weight, _) in enumerate(_CHECKS):
+            if mask >> i & 1:
+                confidence += link_spam[2] if weight is None else weight
         
         # Determine if spam
         is_spam = confidence >= 0.6
+        if not is_spam:
+            return SpamDetection(is_spam=False, confidence=confidence, reasons=[], action='none')
+        
+        # Reason strings are only built for messages that are acted on
+        reasons = []
+        for i, (reason, _, _) in enumerate(_CHECKS):
+            if mask >> i & 1:
+                if reason is None:
+                    reasons.extend(link_spam[1])
+                else:
+                    reasons.append(reason)
         
         return SpamDetection(
-            is_spam=is_spam,
+            is_spam=True,
             confidence=confidence,
             reasons=reasons,
-            action=action if is_spam else 'none'
+            action=_CHECKS[mask.bit_length() - 1][2]
         )
     
-    async def _update_user_behavior(self, message: Message):
+    def _update_user_behavior(self, user_id: int, text: str, has_media: bool):
         """Update user behavior tracking"""
-        user_id = message.from_user.id
-        now = datetime.utcnow()
+        now = time.time()
         
         if user_id not in self.user_behavior:
             self.user_behavior[user_id] = UserBehavior(
-                user_id=user_id,
-                message_count=1,
+                message_times=deque((now,)),
                 last_message_time=now,
-                similar_messages=0,
                 link_count=0,
                 media_count=0,
                 join_time=now,
@@ -159,24 +307,26 @@ class AntiSpamSystem:
         else:
             behavior = self.user_behavior[user_id]
             
-            # Reset counter if more than 1 minute passed
-            if (now - behavior.last_message_time).total_seconds() > 60:
-                behavior.message_count = 1
-            else:
-                behavior.message_count += 1
+            # Slide the flood window forward, dropping sends older than it
+            message_times = behavior.message_times
+            message_times.append(now)
+            cutoff = now - self.flood_window
+            while message_times[0] < cutoff:
+                message_times.popleft()
             
             behavior.last_message_time = now
+            self.user_behavior.move_to_end(user_id)
             
-            # Count links
-            text = message.text or message.caption or ""
-            links = re.findall(r'http[s]?://\S+|www\.\S+|\S+\.\S+/\S+', text)
-            behavior.link_count += len(links)
+            # Count links; every link pattern needs a '/' or 'www.', so
+            # plain chat text skips the regex entirely
+            if '/' in text or 'www.' in text:
+                behavior.link_count += len(_LINK_COUNT_RE.findall(text))
             
             # Count media
-            if message.media:
+            if has_media:
                 behavior.media_count += 1
     
-    async def _check_flood(self, user_id: int, chat_id: int) -> bool:
+    def _check_flood(self, user_id: int, chat_id: int) -> bool:
         """Check for flood behavior"""
         if user_id not in self.user_behavior:
             return False
@@ -190,37 +340,34 @@ class AntiSpamSystem:
         
         return False
     
-    async def _check_similar_messages(self, message: Message) -> bool:
+    def _check_similar_messages(self, chat_id: int, user_id: int, text: str) -> bool:
         """Check for repetitive/similar messages"""
-        chat_id = message.chat.id
-        user_id = message.from_user.id
-        text = message.text or message.caption or ""
-        
         if not text or len(text) < 10:
             return False
         
-        # Create message hash
-        message_hash = hashlib.md5(text.encode()).hexdigest()
+        # Fingerprint the message; only used for in-memory de-duplication
+        message_hash = hash(text)
         
         # Initialize chat hash storage
         if chat_id not in self.message_hashes:
-            self.message_hashes[chat_id] = set()
+            self.message_hashes[chat_id] = (deque(maxlen=self.message_hash_limit), set())
+        
+        recent, seen = self.message_hashes[chat_id]
         
         # Check if similar message exists
-        if message_hash in self.message_hashes[chat_id]:
+        if message_hash in seen:
             logger.info(f"Similar message detected from user {user_id}")
             return True
         
-        # Store message hash
-        self.message_hashes[chat_id].add(message_hash)
-        
-        # Limit stored hashes (keep last 100)
-        if len(self.message_hashes[chat_id]) > 100:
-            self.message_hashes[chat_id] = set(list(self.message_hashes[chat_id])[-100:])
+        # Store message hash, evicting the oldest one when full
+        if len(recent) == recent.maxlen:
+            seen.discard(recent[0])
+        recent.append(message_hash)
+        seen.add(message_hash)
         
         return False
     
-    async def _check_links(self, text: str) -> Tuple[bool, List[str], float]:
+    def _check_links(self, text: str) -> Tuple[bool, List[str], float]:
         """Check for spam/phishing links"""
         if not text:
             return False, [], 0.0
@@ -228,37 +375,41 @@ class AntiSpamSystem:
         reasons = []
         confidence = 0.0
         
-        # Extract URLs
-        urls = re.findall(r'http[s]?://\S+|www\.\S+', text)
+        # Extract URLs along with their hosts in one scan
+        matches = list(_URL_EXTRACT_RE.finditer(text))
         
-        if not urls:
+        if not matches:
             return False, [], 0.0
         
         # Check for too many links
-        if len(urls) > self.link_threshold:
-            reasons.append(f"Too many links ({len(urls)})")
+        if len(matches) > self.link_threshold:
+            reasons.append(f"Too many links ({len(matches)})")
             confidence += 0.3
         
-        for url in urls:
+        for match in matches:
+            url = match.group()
             try:
-                # Parse domain
-                if not url.startswith(('http://', 'https://')):
-                    url = 'http://' + url
+                domain = _normalize_host(match.group('host'))
+                flags = _domain_flags(domain, self.domain_flags)
                 
-                domain = urlparse(url).netloc.lower()
-                
-                # Check against phishing domains
-                if domain in self.phishing_domains:
+                # Check against phishing domains, including their subdomains
+                if flags & _PHISHING_DOMAIN:
                     reasons.append(f"Phishing domain: {domain}")
                     confidence += 0.9
                 
+                # Check for one-character imitations of well-known brands
+                brand = _typosquat_target(domain)
+                if brand:
+                    reasons.append(f"Typosquat of {brand}: {domain}")
+                    confidence += TYPOSQUAT_WEIGHT
+                
                 # Check for suspicious URL patterns
                 if self._is_suspicious_url(url):
                     reasons.append(f"Suspicious URL pattern: {domain}")
                     confidence += 0.6
                 
                 # Check for URL shorteners
-                if self._is_url_shortener(domain):
+                if flags & _SHORTENER_DOMAIN:
                     reasons.append(f"URL shortener: {domain}")
                     confidence += 0.4
                 
@@ -269,37 +420,15 @@ class AntiSpamSystem:
     
     def _is_suspicious_url(self, url: str) -> bool:
         """Check if URL has suspicious patterns"""
-        suspicious_patterns = [
-            r'[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}\.[0-9]{1,3}',  # IP addresses
-            r'[a-z]{20,}\.com',  # Very long domain names
-            r'.*telegram.*bot.*',  # Fake telegram bot URLs
-            r'.*crypto.*giveaway.*',  # Crypto giveaway scams
-            r'.*free.*money.*',  # Free money scams
-        ]
-        
-        for pattern in suspicious_patterns:
-            if re.search(pattern, url.lower()):
-                return True
-        
-        return False
-    
-    def _is_url_shortener(self, domain: str) -> bool:
-        """Check if domain is a URL shortener"""
-        shorteners = {
-            'bit.ly', 'tinyurl.com', 'short.link', 'rebrand.ly',
-            'ow.ly', 'buff.ly', 't.co', 'goo.gl', 'tiny.cc'
-        }
-        return domain in shorteners
+        return _SUSPICIOUS_URL_RE.search(url.lower()) is not None
     
-    async def _check_new_user_spam(self, message: Message) -> bool:
+    def _check_new_user_spam(self, user_id: int) -> bool:
         """Check for new user spam behavior"""
-        user_id = message.from_user.id
-        
         if user_id not in self.user_behavior:
             return False
         
         behavior = self.user_behavior[user_id]
-        user_age = (datetime.utcnow() - behavior.join_time).total_seconds() / 3600  # hours
+        user_age = (time.time() - behavior.join_time) / 3600  # hours
         
         # New user (less than 24 hours) with suspicious behavior
         if user_age < self.new_user_restriction_hours:
@@ -310,55 +439,65 @@ class AntiSpamSystem:
         
         return False
     
-    async def _check_fake_user(self, user: User) -> bool:
+    def _check_profile(self, user_id: int, username: Optional[str],
+                       first_name: Optional[str], has_photo: bool) -> int:
+        """Run the profile checks, reusing the last verdict while the profile is unchanged"""
+        now = time.time()
+        profile = (username, first_name, has_photo)
+        
+        cached = self.profile_verdicts.get(user_id)
+        if cached and cached[0] > now and cached[1] == profile:
+            return cached[2]
+        
+        mask = 0
+        if self._check_fake_user(username, first_name, has_photo):
+            mask |= _FAKE_USER
+        if self._check_suspicious_username(username):
+            mask |= _SUSPICIOUS_USERNAME
+        
+        self.profile_verdicts[user_id] = (now + self.profile_verdict_ttl, profile, mask)
+        return mask
+    
+    @staticmethod
+    def _check_fake_user(username: Optional[str], first_name: Optional[str], has_photo: bool) -> bool:
         """Check for fake user indicators"""
         reasons = []
         
         # Check if user has profile photo
-        if not user.photo:
+        if not has_photo:
             reasons.append("No profile photo")
         
         # Check username patterns
-        if user.username:
+        if username:
             # Too many numbers
-            if len(re.findall(r'\d', user.username)) > 5:
+            if len(username) - len(username.translate(_STRIP_DIGITS)) > 5:
                 reasons.append("Too many numbers in username")
             
             # Random character patterns
-            if re.search(r'[a-z]{3,}\d{3,}', user.username.lower()):
+            if _RANDOM_USERNAME_RE.search(username.lower()):
                 reasons.append("Random username pattern")
         
         # Check name patterns
-        if user.first_name:
+        if first_name:
             # Very short or very long names
-            if len(user.first_name) < 2 or len(user.first_name) > 20:
+            if len(first_name) < 2 or len(first_name) > 20:
                 reasons.append("Suspicious name length")
             
             # Only numbers in name
-            if user.first_name.isdigit():
+            if first_name.isdigit():
                 reasons.append("Numeric name")
         
         return len(reasons) >= 2  # Multiple indicators
     
-    async def _check_suspicious_username(self, username: str) -> bool:
+    @staticmethod
+    def _check_suspicious_username(username: Optional[str]) -> bool:
         """Check for suspicious username patterns"""
         if not username:
             return False
         
         username = username.lower()
         
-        suspicious_patterns = [
-            r'^[a-z]+\d{5,}$',  # letters followed by many numbers
-            r'^\d+[a-z]+\d+$',  # numbers-letters-numbers
-            r'^(test|temp|fake|spam)\d+$',  # common fake patterns
-            r'^[a-z]{1,3}\d{8,}$',  # very short letters + many numbers
-        ]
-        
-        for pattern in suspicious_patterns:
-            if re.match(pattern, username):
-                return True
-        
-        return False
+        return _SUSPICIOUS_USERNAME_RE.fullmatch(username) is not None
     
     async def check_disposable_email(self, email: str) -> bool:
         """Check if email is from disposable email service"""
@@ -374,42 +513,45 @@ class AntiSpamSystem:
         chat_id = message.chat.id
         user_mention = format_user_mention(message.from_user)
         
-        # Log the detection
-        await self.db.log_moderation_action(
-            chat_id, user_id, f"Spam detected: {detection.action}",
-            f"Confidence: {detection.confidence:.2f}, Reasons: {', '.join(detection.reasons)}",
-            message.text or message.caption or "Media message"
+        # Log the detection and delete the spam message concurrently;
+        # a failed delete is ignored as before
+        await asyncio.gather(
+            self.db.log_moderation_action(
+                chat_id, user_id, f"Spam detected: {detection.action}",
+                f"Confidence: {detection.confidence:.2f}, Reasons: {', '.join(detection.reasons)}",
+                message.text or message.caption or "Media message"
+            ),
+            message.delete(),
+            return_exceptions=True
         )
         
-        # Delete the spam message
-        try:
-            await message.delete()
-        except:
-            pass
-        
         if detection.action == 'warn':
             # Increment warnings
             if user_id in self.user_behavior:
                 self.user_behavior[user_id].warnings += 1
                 warnings = self.user_behavior[user_id].warnings
                 
-                warning_msg = await self.client.send_message(
+                warning_send = self.client.send_message(
                     chat_id,
                     f"⚠️ {user_mention} received a warning for spam behavior.\n"
                     f"Warnings: {warnings}/3\n"
                     f"Reason: {', '.join(detection.reasons)}"
                 )
                 
-                # Auto-ban after 3 warnings
-                if warnings >= 3:
-                    await safe_ban_user(self.client, chat_id, user_id)
+                # Auto-ban after 3 warnings, alongside the warning
+                if warnings < 3:
+                    warning_msg = await warning_send
+                else:
+                    warning_msg, _ = await asyncio.gather(
+                        warning_send, safe_ban_user(self.client, chat_id, user_id)
+                    )
                     await self.client.send_message(
                         chat_id,
                         f"🚫 {user_mention} has been banned for repeated spam violations."
                     )
                 
                 # Auto-delete warning after 30 seconds
-                asyncio.create_task(self._delete_after(chat_id, warning_msg.id, 30))
+                self.deleter.delete_after(chat_id, warning_msg.id, 30)
         
         elif detection.action == 'mute':
             # Mute for 1 hour
@@ -426,7 +568,7 @@ class AntiSpamSystem:
                 )
                 
                 # Auto-delete mute message after 30 seconds
-                asyncio.create_task(self._delete_after(chat_id, mute_msg.id, 30))
+                self.deleter.delete_after(chat_id, mute_msg.id, 30)
         
         elif detection.action == 'ban':
             # Permanent ban
@@ -440,50 +582,53 @@ class AntiSpamSystem:
                 )
                 
                 # Auto-delete ban message after 30 seconds
-                asyncio.create_task(self._delete_after(chat_id, ban_msg.id, 30))
+                self.deleter.delete_after(chat_id, ban_msg.id, 30)
     
-    async def _delete_after(self, chat_id: int, message_id: int, delay: int):
-        """Delete message after delay"""
-        await asyncio.sleep(delay)
-        try:
-            await self.client.delete_messages(chat_id, message_id)
-        except:
-            pass
+    async def _cleanup_loop(self):
+        """Run cleanup_old_data every CLEANUP_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(CLEANUP_INTERVAL)
+            try:
+                await self.cleanup_old_data()
+            except Exception as e:
+                logger.error(f"Anti-spam cleanup failed: {e}")
     
     async def cleanup_old_data(self):
         """Clean up old behavior data"""
-        now = datetime.utcnow()
-        cutoff = now - timedelta(hours=24)
-        
-        # Clean user behavior data
-        expired_users = []
-        for user_id, behavior in self.user_behavior.items():
-            if behavior.last_message_time < cutoff:
-                expired_users.append(user_id)
-        
-        for user_id in expired_users:
-            del self.user_behavior[user_id]
-        
-        # Clean message hashes
-        for chat_id in list(self.message_hashes.keys()):
-            if len(self.message_hashes[chat_id]) > 1000:
-                # Keep only recent hashes
-                self.message_hashes[chat_id] = set(
-                    list(self.message_hashes[chat_id])[-500:]
-                )
+        now = time.time()
+        cutoff = now - 24 * 3600
+        
+        # Clean user behavior data, popping the least recently active users first
+        expired_users = 0
+        while self.user_behavior:
+            behavior = next(iter(self.user_behavior.values()))
+            if behavior.last_message_time >= cutoff:
+                break
+            self.user_behavior.popitem(last=False)
+            expired_users += 1
+        
+        # Drop expired profile verdicts
+        self.profile_verdicts = {
+            user_id: verdict for user_id, verdict in self.profile_verdicts.items()
+            if verdict[0] > now
+        }
         
-        logger.info(f"Cleaned up {len(expired_users)} expired user behavior records")
+        # Message hashes are bounded per chat by their deque, no trimming needed
+        
+        logger.info(f"Cleaned up {expired_users} expired user behavior records")
     
     async def get_user_spam_score(self, user_id: int) -> float:
         """Get user's current spam score"""
         if user_id not in self.user_behavior:
             return 0.0
         
-        behavior = self.user_behavior[user_id]
-        score = 0.0
-        
+        return self._spam_score(self.user_behavior[user_id], time.time())
+    
+    @staticmethod
+    def _spam_score(behavior: UserBehavior, now: float) -> float:
+        """Score a user's behavior at the given time"""
         # Factor in warnings
-        score += behavior.warnings * 0.3
+        score = behavior.warnings * 0.3
         
         # Factor in message frequency
         if behavior.message_count > 10:
@@ -494,8 +639,7 @@ class AntiSpamSystem:
             score += 0.3
         
         # Factor in account age
-        account_age_hours = (datetime.utcnow() - behavior.join_time).total_seconds() / 3600
-        if account_age_hours < 24:
+        if now - behavior.join_time < 24 * 3600:
             score += 0.2
         
         return min(score, 1.0)
@@ -513,14 +657,13 @@ class AntiSpamSystem:
         """Add user to spam blacklist"""
         # Mark user as spam
         if user_id not in self.user_behavior:
+            now = time.time()
             self.user_behavior[user_id] = UserBehavior(
-                user_id=user_id,
-                message_count=0,
-                last_message_time=datetime.utcnow(),
-                similar_messages=0,
+                message_times=deque(),
+                last_message_time=now,
                 link_count=0,
                 media_count=0,
-                join_time=datetime.utcnow(),
+                join_time=now,
                 warnings=10  # High warning count
             )
         else:
@@ -3,11 +3,14 @@ Advanced Captcha System for Telegram Protection Bot
 Supports text, math, button, and voice captcha verification
 """
 
+import time
+import heapq
 import random
 import asyncio
 import logging
+from collections import Counter
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Coroutine, Dict, List, Optional, Set, Tuple
 from pyrogram.client import Client
 from pyrogram.types import (
     Message, InlineKeyboardMarkup, InlineKeyboardButton, 
@@ -15,10 +18,70 @@ from pyrogram.types import (
 )
 from pyrogram.enums import ChatMemberStatus
 from database import Database
-from utils import format_user_mention, safe_restrict_user
+from utils import DelayedDeleter, format_user_mention, safe_restrict_user
 
 logger = logging.getLogger(__name__)
 
+# Permissions restored to members who pass verification
+_FULL_PERMISSIONS = ChatPermissions(
+    can_send_messages=True,
+    can_send_media_messages=True,
+    can_send_polls=True,
+    can_send_other_messages=True,
+    can_add_web_page_previews=True,
+    can_change_info=False,
+    can_invite_users=False,
+    can_pin_messages=False
+)
+
+# Verification prompt sent to each joining user
+_WELCOME_TEMPLATE = """
+🛡️ **Welcome Verification Required**
+
+{user_mention}, please complete the verification below to access this group.
+
+{question}
+
+⏰ You have {minutes} minutes to complete this.
+❌ Failure to verify will result in removal from the group.
+            """
+
+# Callback data prefix of button captcha answers
+CAPTCHA_CALLBACK_PREFIX = "captcha_"
+
+# Every math captcha as (question, answer), grouped by operation so each
+# operation stays equally likely
+_MATH_CAPTCHAS = tuple(
+    tuple(
+        (f"Solve: **{a} {op} {b} = ?**", str(result(a, b)))
+        for a in range(*a_range) for b in range(*b_range)
+    )
+    for a_range, b_range, op, result in (
+        ((1, 21), (1, 21), '+', lambda a, b: a + b),
+        ((10, 51), (1, 11), '-', lambda a, b: a - b),
+        ((1, 13), (1, 13), '*', lambda a, b: a * b),
+    )
+)
+
+# Button captchas are drawn from a pool built once instead of per join
+BUTTON_CAPTCHA_POOL_SIZE = 256
+
+# User mentions are cached so a verification costs at most one get_users call
+USER_MENTION_CACHE_TTL = 3600
+USER_MENTION_CACHE_SIZE = 10000
+
+# Telegram API calls made by the captcha system are paced below the
+# bot-wide limit of about 30 requests per second
+API_CALLS_PER_SECOND = 25
+API_CALL_BURST = 25
+
+# Text captchas likewise reuse precomputed scrambles of a fixed word list
+TEXT_CAPTCHA_SCRAMBLES_PER_WORD = 32
+_CAPTCHA_WORDS = (
+    "PROTECT", "SECURE", "VERIFY", "TELEGRAM", "SAFETY",
+    "GUARD", "SHIELD", "DEFEND", "TRUST", "CHECK"
+)
+
 class CaptchaSystem:
     """Advanced captcha verification system"""
     
@@ -26,57 +89,64 @@ class CaptchaSystem:
         self.client = client
         self.db = db
         self.pending_verifications = {}  # user_id: verification_data
+        self.pending_by_chat: Counter = Counter()  # chat_id: pending verification count
+        self.verifications_starting: Dict[Tuple[int, int], asyncio.Future] = {}  # (chat_id, user_id): start result
         self.captcha_timeout = 300  # 5 minutes
+        self.text_captcha_pool = [
+            (''.join(random.sample(word, len(word))), word.lower())
+            for word in _CAPTCHA_WORDS
+            for _ in range(TEXT_CAPTCHA_SCRAMBLES_PER_WORD)
+        ]
+        self.button_captcha_pool = [
+            self._build_button_captcha() for _ in range(BUTTON_CAPTCHA_POOL_SIZE)
+        ]
+        
+        # (timeout, user_id) min-heap drained by a single reaper task
+        self.timeout_heap: List[Tuple[float, int]] = []
+        self.timeout_wakeup = asyncio.Event()
+        self.reaper_task: Optional[asyncio.Task] = None
+        
+        # Expiries in flight, referenced until done so they are not collected
+        self.background_tasks: Set[asyncio.Task] = set()
+        
+        # user_id: (expiry, mention) for recently looked up users
+        self.mention_cache: Dict[int, Tuple[float, str]] = {}
+        
+        # Token bucket for pacing Telegram API calls
+        self.api_tokens = float(API_CALL_BURST)
+        self.api_tokens_at = time.monotonic()
+        
+        # Batched immediate and delayed deletions, paced by the token bucket
+        self.deleter = DelayedDeleter(client, throttle=self._throttle)
         
     async def generate_text_captcha(self) -> Tuple[str, str]:
         """Generate text-based captcha"""
-        words = [
-            "PROTECT", "SECURE", "VERIFY", "TELEGRAM", "SAFETY",
-            "GUARD", "SHIELD", "DEFEND", "TRUST", "CHECK"
-        ]
-        word = random.choice(words)
-        scrambled = ''.join(random.sample(word, len(word)))
+        scrambled, answer = random.choice(self.text_captcha_pool)
         
         question = f"Unscramble this word: **{scrambled}**"
-        answer = word.lower()
         
         return question, answer
     
     async def generate_math_captcha(self) -> Tuple[str, str]:
         """Generate math-based captcha"""
-        operations = [
-            lambda: (random.randint(1, 20), random.randint(1, 20), '+'),
-            lambda: (random.randint(10, 50), random.randint(1, 10), '-'),
-            lambda: (random.randint(1, 12), random.randint(1, 12), '*'),
-        ]
-        
-        a, b, op = random.choice(operations)()
-        
-        if op == '+':
-            result = a + b
-        elif op == '-':
-            result = a - b
-        elif op == '*':
-            result = a * b
-        else:
-            result = 0
-        
-        question = f"Solve: **{a} {op} {b} = ?**"
-        answer = str(result)
-        
-        return question, answer
+        # Pick an operation, then one of its operand pairs
+        return random.choice(random.choice(_MATH_CAPTCHAS))
     
     async def generate_button_captcha(self) -> Tuple[str, str, InlineKeyboardMarkup]:
         """Generate button-based captcha"""
-        correct_answer = random.randint(1000, 9999)
-        wrong_answers = [random.randint(1000, 9999) for _ in range(5)]
+        correct_answer, keyboard = random.choice(self.button_captcha_pool)
         
-        # Ensure no duplicates
-        while any(ans == correct_answer for ans in wrong_answers):
-            wrong_answers = [random.randint(1000, 9999) for _ in range(5)]
+        question = f"Click the number: **{correct_answer}**"
+        answer = str(correct_answer)
         
-        all_answers = wrong_answers + [correct_answer]
-        random.shuffle(all_answers)
+        return question, answer, keyboard
+    
+    @staticmethod
+    def _build_button_captcha() -> Tuple[int, InlineKeyboardMarkup]:
+        """Build one button captcha keyboard and its correct answer"""
+        # Six distinct numbers in random order; any one of them can be the answer
+        all_answers = random.sample(range(1000, 10000), 6)
+        correct_answer = random.choice(all_answers)
         
         # Create keyboard
         keyboard = []
@@ -86,21 +156,39 @@ class CaptchaSystem:
                 row.append(
                     InlineKeyboardButton(
                         str(all_answers[j]),
-                        callback_data=f"captcha_{all_answers[j]}"
+                        callback_data=f"{CAPTCHA_CALLBACK_PREFIX}{all_answers[j]}"
                     )
                 )
             keyboard.append(row)
         
-        question = f"Click the number: **{correct_answer}**"
-        answer = str(correct_answer)
-        
-        return question, answer, InlineKeyboardMarkup(keyboard)
+        return correct_answer, InlineKeyboardMarkup(keyboard)
     
     async def start_verification(self, chat_id: int, user_id: int, 
                                 captcha_type: str = "button") -> bool:
         """Start captcha verification for a user"""
+        # Duplicate join updates for the same chat share the verification already
+        # being started; a join to another chat still gets its own restriction
+        key = (chat_id, user_id)
+        starting = self.verifications_starting.get(key)
+        if starting is not None:
+            return await asyncio.shield(starting)
+        
+        starting = asyncio.get_running_loop().create_future()
+        self.verifications_starting[key] = starting
+        try:
+            result = await self._start_verification(chat_id, user_id, captcha_type)
+            starting.set_result(result)
+            return result
+        finally:
+            del self.verifications_starting[key]
+            if not starting.done():
+                starting.cancel()
+    
+    async def _start_verification(self, chat_id: int, user_id: int, captcha_type: str) -> bool:
+        """Restrict the user and send them a captcha"""
         try:
             # Restrict user until verification
+            await self._throttle()
             success = await safe_restrict_user(
                 self.client, chat_id, user_id,
                 until_date=datetime.utcnow() + timedelta(minutes=10)
@@ -130,33 +218,22 @@ class CaptchaSystem:
                 'type': captcha_type,
                 'attempts': 0,
                 'max_attempts': 3,
-                'created_at': datetime.utcnow(),
-                'timeout': datetime.utcnow() + timedelta(seconds=self.captcha_timeout)
+                'timeout': time.monotonic() + self.captcha_timeout
             }
             
-            self.pending_verifications[user_id] = verification_data
+            self._add_pending(user_id, verification_data)
             
             # Get user info
-            try:
-                user = await self.client.get_users(user_id)
-                if isinstance(user, list):
-                    user = user[0] if user else None
-                user_mention = format_user_mention(user) if user else f"User {user_id}"
-            except:
-                user_mention = f"User {user_id}"
+            user_mention = await self._get_user_mention(user_id)
             
             # Send captcha message
-            welcome_text = f"""
-🛡️ **Welcome Verification Required**
-
-{user_mention}, please complete the verification below to access this group.
-
-{question}
-
-⏰ You have {self.captcha_timeout // 60} minutes to complete this.
-❌ Failure to verify will result in removal from the group.
-            """
+            welcome_text = _WELCOME_TEMPLATE.format(
+                user_mention=user_mention,
+                question=question,
+                minutes=self.captcha_timeout // 60
+            )
             
+            await self._throttle()
             if keyboard:
                 captcha_msg = await self.client.send_message(
                     chat_id, welcome_text, reply_markup=keyboard
@@ -168,7 +245,7 @@ class CaptchaSystem:
             verification_data['message_id'] = captcha_msg.id
             
             # Schedule timeout cleanup
-            asyncio.create_task(self._handle_timeout(user_id))
+            self._schedule_timeout(user_id, verification_data['timeout'])
             
             logger.info(f"Started {captcha_type} verification for user {user_id} in chat {chat_id}")
             return True
@@ -177,12 +254,37 @@ class CaptchaSystem:
             logger.error(f"Failed to start verification: {e}")
             return False
     
+    async def _get_user_mention(self, user_id: int) -> str:
+        """Get a user's mention, reusing recent lookups"""
+        now = time.monotonic()
+        cached = self.mention_cache.get(user_id)
+        if cached and cached[0] > now:
+            return cached[1]
+        
+        try:
+            await self._throttle()
+            user = await self.client.get_users(user_id)
+            if isinstance(user, list):
+                user = user[0] if user else None
+        except:
+            return f"User {user_id}"
+        
+        user_mention = format_user_mention(user) if user else f"User {user_id}"
+        
+        # Evict the oldest entry when full
+        self.mention_cache.pop(user_id, None)
+        if len(self.mention_cache) >= USER_MENTION_CACHE_SIZE:
+            del self.mention_cache[next(iter(self.mention_cache))]
+        self.mention_cache[user_id] = (now + USER_MENTION_CACHE_TTL, user_mention)
+        
+        return user_mention
+    
     async def verify_answer(self, user_id: int, provided_answer: str) -> bool:
         """Verify user's captcha answer"""
-        if user_id not in self.pending_verifications:
+        verification = self.pending_verifications.get(user_id)
+        if verification is None:
             return False
         
-        verification = self.pending_verifications[user_id]
         verification['attempts'] += 1
         
         # Check if answer is correct
@@ -198,6 +300,7 @@ class CaptchaSystem:
         # Send retry message
         remaining_attempts = verification['max_attempts'] - verification['attempts']
         try:
+            await self._throttle()
             await self.client.send_message(
                 verification['chat_id'],
                 f"❌ Incorrect answer. You have {remaining_attempts} attempts remaining."
@@ -209,11 +312,12 @@ class CaptchaSystem:
     
     async def handle_callback(self, callback_query: CallbackQuery) -> bool:
         """Handle button captcha callbacks"""
-        if not callback_query.data or not callback_query.data.startswith("captcha_"):
+        data = callback_query.data or ""
+        if not data.startswith(CAPTCHA_CALLBACK_PREFIX):
             return False
         
         user_id = callback_query.from_user.id
-        provided_answer = callback_query.data.replace("captcha_", "")
+        provided_answer = data[len(CAPTCHA_CALLBACK_PREFIX):]
         
         result = await self.verify_answer(user_id, provided_answer)
         
@@ -226,98 +330,134 @@ class CaptchaSystem:
     
     async def _complete_verification(self, user_id: int, success: bool):
         """Complete verification process"""
-        if user_id not in self.pending_verifications:
+        # Claim the entry before any await so a racing answer or timeout
+        # finds nothing left to complete
+        verification = self._remove_pending(user_id)
+        if verification is None:
             return
         
-        verification = self.pending_verifications[user_id]
         chat_id = verification['chat_id']
         
         try:
             if success:
-                # Unrestrict user - give full permissions
-                full_permissions = ChatPermissions(
-                    can_send_messages=True,
-                    can_send_media_messages=True,
-                    can_send_polls=True,
-                    can_send_other_messages=True,
-                    can_add_web_page_previews=True,
-                    can_change_info=False,
-                    can_invite_users=False,
-                    can_pin_messages=False
-                )
-                await self.client.restrict_chat_member(
-                    chat_id, user_id, permissions=full_permissions
-                )
-                
-                # Send success message
-                user = await self.client.get_users(user_id)
-                if isinstance(user, list):
-                    user = user[0] if user else None
-                user_mention = format_user_mention(user) if user else f"User {user_id}"
-                
-                success_msg = await self.client.send_message(
-                    chat_id,
-                    f"✅ {user_mention} has been successfully verified and can now participate in the group!"
-                )
-                
-                # Log successful verification
-                await self.db.log_moderation_action(
-                    chat_id, user_id, "Verification completed", "Captcha solved successfully"
+                user_mention = await self._get_user_mention(user_id)
+                notice_text = f"✅ {user_mention} has been successfully verified and can now participate in the group!"
+                log_entry = ("Verification completed", "Captcha solved successfully")
+            else:
+                notice_text = f"❌ User failed verification and has been removed from the group."
+                log_entry = ("Verification failed", "Failed to solve captcha")
+            
+            await self._throttle(2)
+            if success:
+                # Unrestrict user with full permissions
+                member_update = self.client.restrict_chat_member(
+                    chat_id, user_id, permissions=_FULL_PERMISSIONS
                 )
-                
-                # Auto-delete success message after 30 seconds
-                asyncio.create_task(self._delete_message_after(chat_id, success_msg.id, 30))
-                
             else:
                 # Ban user for failed verification
-                await self.client.ban_chat_member(chat_id, user_id)
-                
-                # Send failure message
-                fail_msg = await self.client.send_message(
-                    chat_id,
-                    f"❌ User failed verification and has been removed from the group."
-                )
-                
-                # Log failed verification
-                await self.db.log_moderation_action(
-                    chat_id, user_id, "Verification failed", "Failed to solve captcha"
-                )
-                
-                # Auto-delete failure message after 30 seconds
-                asyncio.create_task(self._delete_message_after(chat_id, fail_msg.id, 30))
+                member_update = self.client.ban_chat_member(chat_id, user_id)
             
-            # Clean up captcha message
-            if 'message_id' in verification:
-                try:
-                    await self.client.delete_messages(chat_id, verification['message_id'])
-                except:
-                    pass
+            # Update the member, announce and log concurrently; each outcome is checked on its own
+            updated, notice, logged = await asyncio.gather(
+                member_update,
+                self.client.send_message(chat_id, notice_text),
+                self.db.log_moderation_action(chat_id, user_id, *log_entry),
+                return_exceptions=True
+            )
+            
+            if isinstance(updated, Exception):
+                logger.error(f"Error {'unrestricting' if success else 'banning'} user {user_id} in {chat_id}: {updated}")
+            if isinstance(logged, Exception):
+                logger.error(f"Error logging verification of user {user_id}: {logged}")
+            
+            if isinstance(notice, Exception):
+                logger.error(f"Error announcing verification of user {user_id}: {notice}")
+            elif isinstance(updated, Exception):
+                # The announcement did not happen; take it down right away
+                self.deleter.delete(chat_id, notice.id)
+            else:
+                # Auto-delete the announcement after 30 seconds
+                self.deleter.delete_after(chat_id, notice.id, 30)
             
         except Exception as e:
             logger.error(f"Error completing verification: {e}")
         
         finally:
-            # Remove from pending verifications
-            del self.pending_verifications[user_id]
+            # Clean up captcha message
+            if 'message_id' in verification:
+                self.deleter.delete(chat_id, verification['message_id'])
     
-    async def _handle_timeout(self, user_id: int):
-        """Handle verification timeout"""
-        await asyncio.sleep(self.captcha_timeout)
+    async def _throttle(self, calls: int = 1):
+        """Wait until the token bucket allows this many API calls"""
+        while True:
+            now = time.monotonic()
+            self.api_tokens = min(
+                API_CALL_BURST,
+                self.api_tokens + (now - self.api_tokens_at) * API_CALLS_PER_SECOND
+            )
+            self.api_tokens_at = now
+            
+            if self.api_tokens >= calls:
+                self.api_tokens -= calls
+                return
+            
+            await asyncio.sleep((calls - self.api_tokens) / API_CALLS_PER_SECOND)
+    
+    def _schedule_timeout(self, user_id: int, timeout: float):
+        """Queue a verification timeout for the reaper task"""
+        heapq.heappush(self.timeout_heap, (timeout, user_id))
+        
+        # Only wake the reaper if this entry is now the earliest deadline
+        if self.timeout_heap[0] == (timeout, user_id):
+            self.timeout_wakeup.set()
         
-        if user_id in self.pending_verifications:
-            verification = self.pending_verifications[user_id]
+        if self.reaper_task is None or self.reaper_task.done():
+            self.reaper_task = asyncio.create_task(self._reap_timeouts())
+    
+    def _is_current_timeout(self, user_id: int, timeout: float) -> bool:
+        """Check a heap entry still belongs to the user's pending verification"""
+        # Entries for completed, cancelled or replaced verifications are stale
+        verification = self.pending_verifications.get(user_id)
+        return verification is not None and verification['timeout'] == timeout
+    
+    async def _reap_timeouts(self):
+        """Fail verifications as their timeouts pass, sleeping until the next one"""
+        while True:
+            self.timeout_wakeup.clear()
+            
+            if not self.timeout_heap:
+                await self.timeout_wakeup.wait()
+                continue
+            
+            timeout, user_id = self.timeout_heap[0]
+            delay = timeout - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.timeout_wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            heapq.heappop(self.timeout_heap)
             
-            # Check if still within timeout
-            if datetime.utcnow() > verification['timeout']:
-                await self._complete_verification(user_id, success=False)
+            # Each expiry runs on its own so later deadlines are not held up;
+            # _throttle paces their API calls
+            if self._is_current_timeout(user_id, timeout):
+                self._spawn(self._expire_verification(user_id))
     
-    async def _delete_message_after(self, chat_id: int, message_id: int, delay: int):
-        """Delete message after delay"""
-        await asyncio.sleep(delay)
+    async def _expire_verification(self, user_id: int):
+        """Fail a verification whose timeout has passed"""
         try:
-            await self.client.delete_messages(chat_id, message_id)
-        except:
-            pass
+            await self._complete_verification(user_id, success=False)
+        except Exception as e:
+            logger.error(f"Error expiring verification for user {user_id}: {e}")
+    
+    def _spawn(self, coro: Coroutine) -> asyncio.Task:
+        """Run a coroutine in the background, keeping a reference until it finishes"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
     
     async def is_pending_verification(self, user_id: int) -> bool:
         """Check if user has pending verification"""
@@ -325,36 +465,42 @@ class CaptchaSystem:
     
     async def cancel_verification(self, user_id: int):
         """Cancel pending verification"""
-        if user_id in self.pending_verifications:
-            verification = self.pending_verifications[user_id]
-            
-            # Clean up captcha message
-            if 'message_id' in verification:
-                try:
-                    await self.client.delete_messages(
-                        verification['chat_id'], verification['message_id']
-                    )
-                except:
-                    pass
-            
-            del self.pending_verifications[user_id]
+        verification = self._remove_pending(user_id)
+        
+        # Clean up captcha message
+        if verification is not None and 'message_id' in verification:
+            self.deleter.delete(verification['chat_id'], verification['message_id'])
+    
+    def _add_pending(self, user_id: int, verification: dict):
+        """Track a pending verification, replacing any earlier one for the user"""
+        self._remove_pending(user_id)
+        self.pending_verifications[user_id] = verification
+        self.pending_by_chat[verification['chat_id']] += 1
     
-    async def get_pending_count(self, chat_id: int) -> int:
+    def _remove_pending(self, user_id: int) -> Optional[dict]:
+        """Stop tracking a user's pending verification and return it"""
+        verification = self.pending_verifications.pop(user_id, None)
+        if verification is None:
+            return None
+        
+        chat_id = verification['chat_id']
+        if self.pending_by_chat[chat_id] <= 1:
+            del self.pending_by_chat[chat_id]
+        else:
+            self.pending_by_chat[chat_id] -= 1
+        
+        return verification
+    
+    def get_pending_count(self, chat_id: int) -> int:
         """Get number of pending verifications for a chat"""
-        count = 0
-        for verification in self.pending_verifications.values():
-            if verification['chat_id'] == chat_id:
-                count += 1
-        return count
+        return self.pending_by_chat.get(chat_id, 0)
     
     async def cleanup_expired(self):
         """Clean up expired verifications"""
-        expired_users = []
-        now = datetime.utcnow()
-        
-        for user_id, verification in self.pending_verifications.items():
-            if now > verification['timeout']:
-                expired_users.append(user_id)
+        now = time.monotonic()
         
-        for user_id in expired_users:
-            await self._complete_verification(user_id, success=False)
\ No newline at end of file
+        # Only the due front of the timeout heap is touched
+        while self.timeout_heap and self.timeout_heap[0][0] < now:
+            timeout, user_id = heapq.heappop(self.timeout_heap)
+            if self._is_current_timeout(user_id, timeout):
+                await self._complete_verification(user_id, success=False)
\ No newline at end of file
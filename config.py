@@ -4,47 +4,104 @@ Configuration management for Telegram Protection Bot
 
 import os
 import json
+from functools import cached_property
 from typing import List, Dict, Any
 from dotenv import load_dotenv
 
 load_dotenv()
 
+def _env_flag(name: str, default: str = "true") -> bool:
+    """Read a true/false environment variable"""
+    return os.getenv(name, default).lower() == "true"
+
 class Config:
     """Bot configuration class"""
     
     def __init__(self):
-        # Telegram API credentials
-        self.API_ID = int(os.getenv("API_ID", "0"))
-        self.API_HASH = os.getenv("API_HASH", "")
-        self.BOT_TOKEN = os.getenv("BOT_TOKEN", "")
-        
-        # Database configuration
-        self.DATABASE_PATH = os.getenv("DATABASE_PATH", "bot_data.db")
-        
-        # Moderation settings
-        self.MAX_MESSAGES_PER_MINUTE = int(os.getenv("MAX_MESSAGES_PER_MINUTE", "10"))
-        self.FLOOD_THRESHOLD = int(os.getenv("FLOOD_THRESHOLD", "5"))
-        self.FLOOD_TIMEFRAME = int(os.getenv("FLOOD_TIMEFRAME", "60"))  # seconds
-        
-        # Feature toggles
-        self.ENABLE_TEXT_FILTER = os.getenv("ENABLE_TEXT_FILTER", "true").lower() == "true"
-        self.ENABLE_EDIT_MONITOR = os.getenv("ENABLE_EDIT_MONITOR", "true").lower() == "true"
-        self.ENABLE_MEDIA_FILTER = os.getenv("ENABLE_MEDIA_FILTER", "true").lower() == "true"
-        self.ENABLE_ANTI_FLOOD = os.getenv("ENABLE_ANTI_FLOOD", "true").lower() == "true"
-        
-        # Logging settings
-        self.LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "30"))
-        self.ENABLE_AUDIT_LOGS = os.getenv("ENABLE_AUDIT_LOGS", "true").lower() == "true"
-        
-        # Admin settings
-        self.SUDO_USERS = self._parse_user_list(os.getenv("SUDO_USERS", ""))
-        
-        # Keywords file path
-        self.KEYWORDS_FILE = os.getenv("KEYWORDS_FILE", "keywords.json")
+        # Parsed keywords file, reused until its modification time changes
+        self._keywords_cache = None
+        self._keywords_mtime = None
         
         # Validation
         self._validate_config()
     
+    # Settings below are read from the environment on first access and
+    # cached on the instance until reload()
+    
+    # Telegram API credentials
+    @cached_property
+    def API_ID(self) -> int:
+        return int(os.getenv("API_ID", "0"))
+    
+    @cached_property
+    def API_HASH(self) -> str:
+        return os.getenv("API_HASH", "")
+    
+    @cached_property
+    def BOT_TOKEN(self) -> str:
+        return os.getenv("BOT_TOKEN", "")
+    
+    # Database configuration
+    @cached_property
+    def DATABASE_PATH(self) -> str:
+        return os.getenv("DATABASE_PATH", "bot_data.db")
+    
+    # Moderation settings
+    @cached_property
+    def MAX_MESSAGES_PER_MINUTE(self) -> int:
+        return int(os.getenv("MAX_MESSAGES_PER_MINUTE", "10"))
+    
+    @cached_property
+    def FLOOD_THRESHOLD(self) -> int:
+        return int(os.getenv("FLOOD_THRESHOLD", "5"))
+    
+    @cached_property
+    def FLOOD_TIMEFRAME(self) -> int:
+        return int(os.getenv("FLOOD_TIMEFRAME", "60"))  # seconds
+    
+    # Feature toggles
+    @cached_property
+    def ENABLE_TEXT_FILTER(self) -> bool:
+        return _env_flag("ENABLE_TEXT_FILTER")
+    
+    @cached_property
+    def ENABLE_EDIT_MONITOR(self) -> bool:
+        return _env_flag("ENABLE_EDIT_MONITOR")
+    
+    @cached_property
+    def ENABLE_MEDIA_FILTER(self) -> bool:
+        return _env_flag("ENABLE_MEDIA_FILTER")
+    
+    @cached_property
+    def ENABLE_ANTI_FLOOD(self) -> bool:
+        return _env_flag("ENABLE_ANTI_FLOOD")
+    
+    # Logging settings
+    @cached_property
+    def LOG_RETENTION_DAYS(self) -> int:
+        return int(os.getenv("LOG_RETENTION_DAYS", "30"))
+    
+    @cached_property
+    def ENABLE_AUDIT_LOGS(self) -> bool:
+        return _env_flag("ENABLE_AUDIT_LOGS")
+    
+    # Admin settings
+    @cached_property
+    def SUDO_USERS(self) -> List[int]:
+        return self._parse_user_list(os.getenv("SUDO_USERS", ""))
+    
+    # Keywords file path
+    @cached_property
+    def KEYWORDS_FILE(self) -> str:
+        return os.getenv("KEYWORDS_FILE", "keywords.json")
+    
+    def reload(self):
+        """Re-read settings from the environment on next access"""
+        for name in _ENV_SETTINGS:
+            self.__dict__.pop(name, None)
+        self._keywords_cache = None
+        self._validate_config()
+    
     def _parse_user_list(self, user_string: str) -> List[int]:
         """Parse comma-separated user IDs"""
         if not user_string:
@@ -65,12 +122,18 @@ class Config:
     def get_keywords(self) -> Dict[str, List[str]]:
         """Load banned keywords from file"""
         try:
-            with open(self.KEYWORDS_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
+            mtime = os.stat(self.KEYWORDS_FILE).st_mtime
+            if self._keywords_cache is None or mtime != self._keywords_mtime:
+                with open(self.KEYWORDS_FILE, 'r', encoding='utf-8') as f:
+                    self._keywords_cache = json.load(f)
+                self._keywords_mtime = mtime
         except FileNotFoundError:
             return self._get_default_keywords()
         except json.JSONDecodeError:
             return self._get_default_keywords()
+        
+        # Callers edit their lists in place, so hand out copies
+        return {category: list(keywords) for category, keywords in self._keywords_cache.items()}
     
     def _get_default_keywords(self) -> Dict[str, List[str]]:
         """Default banned keywords"""
@@ -102,5 +165,14 @@ class Config:
         try:
             with open(self.KEYWORDS_FILE, 'w', encoding='utf-8') as f:
                 json.dump(keywords, f, ensure_ascii=False, indent=2)
+            
+            # Seed the cache with what was just written so it is not parsed back
+            self._keywords_cache = {category: list(words) for category, words in keywords.items()}
+            self._keywords_mtime = os.stat(self.KEYWORDS_FILE).st_mtime
         except Exception as e:
             raise Exception(f"Failed to save keywords: {e}")
+
+# Environment-backed settings cleared by Config.reload()
+_ENV_SETTINGS = tuple(
+    name for name, value in vars(Config).items() if isinstance(value, cached_property)
+)
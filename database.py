@@ -3,14 +3,227 @@ Database operations for Telegram Protection Bot
 """
 
 import aiosqlite
+import time
+import sqlite3
 import asyncio
 import logging
-from datetime import datetime, timedelta
-from typing import List, Dict, Optional, Any
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle
+from operator import itemgetter
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
 from config import Config
 
 logger = logging.getLogger(__name__)
 
+# Bits of the boolean settings packed into group_settings.flags
+FLAG_TEXT_FILTER = 1 << 0
+FLAG_EDIT_MONITOR = 1 << 1
+FLAG_MEDIA_FILTER = 1 << 2
+FLAG_ANTI_FLOOD = 1 << 3
+FLAG_AUTO_DELETE = 1 << 4
+FLAG_LOCKED = 1 << 5
+# Every filter on, group unlocked
+DEFAULT_FLAGS = 0x1F
+
+# Boolean settings key -> flag bit
+SETTING_FLAGS = {
+    'text_filter_enabled': FLAG_TEXT_FILTER,
+    'edit_monitor_enabled': FLAG_EDIT_MONITOR,
+    'media_filter_enabled': FLAG_MEDIA_FILTER,
+    'anti_flood_enabled': FLAG_ANTI_FLOOD,
+    'auto_delete_enabled': FLAG_AUTO_DELETE,
+    'locked': FLAG_LOCKED
+}
+
+# Settings of a group that has never been configured
+DEFAULT_SETTINGS = {
+    'text_filter_enabled': True,
+    'edit_monitor_enabled': True,
+    'media_filter_enabled': True,
+    'anti_flood_enabled': True,
+    'max_messages_per_minute': 10,
+    'flood_threshold': 5,
+    'auto_delete_enabled': True,
+    'locked': False
+}
+
+_settings_numbers = itemgetter('max_messages_per_minute', 'flood_threshold')
+
+# Boolean settings that can be flipped in place
+TOGGLEABLE_SETTINGS = frozenset(SETTING_FLAGS)
+
+# Applied to every file-backed connection as soon as it opens
+CONNECTION_PRAGMAS = (
+    # Only takes effect on a new file, and only before the journal mode is switched
+    "PRAGMA auto_vacuum=INCREMENTAL",
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA mmap_size=268435456",
+)
+
+# Read-only connections used alongside the single writer
+READER_CONNECTIONS = 2
+
+# Worker threads (each with its own sqlite3 connection) for small point reads
+FAST_READ_WORKERS = 4
+
+# Prepared statements kept by sqlite3 per connection, keyed by the exact SQL text
+STATEMENT_CACHE_SIZE = 256
+
+# Statements are module constants so every call hits the statement cache
+_SQL_LOG_MOD = (
+    "INSERT INTO moderation_logs "
+    "(group_id, user_id, action, reason, original_message, edited_message, message_id) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+_SQL_ADD_GROUP = "INSERT OR REPLACE INTO groups (id, title, updated_at) VALUES (?, ?, ?)"
+_SQL_INIT_SETTINGS = "INSERT OR IGNORE INTO group_settings (group_id) VALUES (?)"
+_SQL_ADD_USER = (
+    "INSERT OR REPLACE INTO users "
+    "(id, first_name, last_name, username, is_admin, updated_at) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+_SQL_GET_SETTINGS = (
+    "SELECT flags, max_messages_per_minute, flood_threshold "
+    "FROM group_settings WHERE group_id = ?"
+)
+_SQL_GET_FLOOD_THRESHOLD = "SELECT flood_threshold FROM group_settings WHERE group_id = ?"
+_SQL_UPDATE_SETTINGS = """UPDATE group_settings SET 
+    flags = ?, max_messages_per_minute = ?, flood_threshold = ?, updated_at = ? 
+    WHERE group_id = ?"""
+# Missing rows start from the default flags with the bit flipped; (x | b) - (x & b) is x XOR b
+_SQL_TOGGLE_SETTING = """INSERT INTO group_settings (group_id, flags, updated_at) 
+    VALUES (?, ?, ?) 
+    ON CONFLICT(group_id) DO UPDATE SET 
+    flags = (flags | ?) - (flags & ?), updated_at = excluded.updated_at 
+    RETURNING flags, max_messages_per_minute, flood_threshold"""
+_SQL_SET_SETTING = """INSERT INTO group_settings (group_id, flags, updated_at) 
+    VALUES (?, ?, ?) 
+    ON CONFLICT(group_id) DO UPDATE SET 
+    flags = (flags & ?) | ?, updated_at = excluded.updated_at 
+    RETURNING flags, max_messages_per_minute, flood_threshold"""
+_SQL_GET_LOGS = """SELECT ml.*, u.first_name AS user_name, u.username 
+    FROM moderation_logs ml 
+    LEFT JOIN users u ON ml.user_id = u.id 
+    WHERE ml.group_id = ? 
+    ORDER BY ml.timestamp DESC 
+    LIMIT ?"""
+_SQL_RECENT_ACTIONS = """SELECT ml.action, ml.timestamp, u.first_name 
+    FROM moderation_logs ml 
+    LEFT JOIN users u ON ml.user_id = u.id 
+    WHERE ml.group_id = ? 
+    ORDER BY ml.timestamp DESC 
+    LIMIT ?"""
+_SQL_ACTION_COUNTS = """SELECT action, COUNT(*) 
+    FROM (SELECT action FROM moderation_logs 
+          WHERE group_id = ? 
+          ORDER BY timestamp DESC 
+          LIMIT ?) 
+    GROUP BY action"""
+# Log ids grow with their timestamps, so old logs are one contiguous id range
+_SQL_CLEANUP_BOUNDARY = (
+    "SELECT id FROM moderation_logs WHERE timestamp < ? "
+    "ORDER BY timestamp DESC, id DESC LIMIT 1"
+)
+_SQL_CLEANUP_BATCH = """DELETE FROM moderation_logs WHERE id IN 
+    (SELECT id FROM moderation_logs WHERE id <= ? ORDER BY id LIMIT ?)"""
+
+
+# Writes are committed together at most this many seconds after the first one
+COMMIT_INTERVAL = 0.02
+# Commit early once this many writers are waiting on the same transaction
+COMMIT_BATCH_SIZE = 256
+
+# Groups whose settings are kept in memory, least recently used evicted first
+SETTINGS_CACHE_SIZE = 4096
+
+# Seconds a message counts towards flood detection
+FLOOD_WINDOW = 60
+# Flood windows of users idle this long are dropped by the maintenance task
+FLOOD_IDLE_TTL = 5 * 60
+
+# Old logs deleted per transaction, keeping each cleanup commit and WAL append small
+CLEANUP_BATCH_SIZE = 5000
+
+# Free pages handed back to the filesystem after each log cleanup
+VACUUM_PAGES = 1000
+
+# Seconds between WAL checkpoint / planner statistics runs
+MAINTENANCE_INTERVAL = 15 * 60
+
+# Rows handed to a bulk writer at once, and how long the first row may wait for company
+WRITE_BATCH_SIZE = 256
+WRITE_BATCH_TIMEOUT = 0.05  # seconds
+
+class BatchWriter:
+    """Queue rows from the hot path and pass them to a bulk write method in batches"""
+    
+    def __init__(self, flush: Callable[[List[tuple]], Awaitable[Any]],
+                 batch_size: int = WRITE_BATCH_SIZE, batch_timeout: float = WRITE_BATCH_TIMEOUT):
+        self.flush = flush
+        self.batch_size = batch_size
+        self.batch_timeout = batch_timeout
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.flush_task = None
+        
+        # Rows taken off the queue but not yet handed to a write, and the write in progress
+        self.batch: List[tuple] = []
+        self.writing: Optional[asyncio.Future] = None
+    
+    def submit(self, row: tuple):
+        """Queue a row for the next batch without waiting for the write"""
+        self.queue.put_nowait(row)
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush_loop())
+    
+    async def _flush_loop(self):
+        """Drain the queue in batches of up to batch_size rows"""
+        while True:
+            self.batch.append(await self.queue.get())
+            
+            # Give a partial batch a moment to fill up before writing it
+            if self.queue.qsize() < self.batch_size - 1:
+                await asyncio.sleep(self.batch_timeout)
+            while len(self.batch) < self.batch_size and not self.queue.empty():
+                self.batch.append(self.queue.get_nowait())
+            
+            # Shielded so close() can stop the loop without interrupting a write
+            batch, self.batch = self.batch, []
+            self.writing = asyncio.ensure_future(self._write(batch))
+            await asyncio.shield(self.writing)
+    
+    async def _write(self, batch: List[tuple]):
+        """Pass one batch to the bulk write method, logging any failure"""
+        try:
+            await self.flush(batch)
+        except Exception as e:
+            logger.error("Batch write of %s rows failed: %s", len(batch), e)
+    
+    async def close(self):
+        """Stop the flush loop and write every row still waiting"""
+        task, self.flush_task = self.flush_task, None
+        if task is not None and not task.done():
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        
+        # Let an interrupted write finish before the rows queued behind it
+        if self.writing is not None:
+            await self.writing
+        
+        rows, self.batch = self.batch, []
+        while not self.queue.empty():
+            rows.append(self.queue.get_nowait())
+        for i in range(0, len(rows), self.batch_size):
+            await self._write(rows[i:i + self.batch_size])
+
 class Database:
     """Database manager for bot data"""
     
@@ -18,17 +231,98 @@ class Database:
         self.config = Config()
         self.db_path = self.config.DATABASE_PATH
         self.connection = None
+        self.readers: List[aiosqlite.Connection] = []
+        self.next_reader = None
+        self.fast_read_pool = None
+        self.fast_read_local = threading.local()
+        self.fast_read_connections: List[sqlite3.Connection] = []
+        self.maintenance_task = None
+        self.commit_waiters: List[asyncio.Future] = []
+        self.commit_full = asyncio.Event()
+        self.commit_task = None
+        # group_id -> settings dict, most recently used last
+        self.settings_cache: OrderedDict[int, Dict[str, Any]] = OrderedDict()
+        # group_id -> flood_threshold, read on every message by check_flood
+        self.flood_thresholds: Dict[int, int] = {}
+        # (group_id, user_id) -> monotonic times of messages inside the flood window
+        self.flood_windows: Dict[Tuple[int, int], Deque[float]] = {}
     
     async def initialize(self):
         """Initialize database connection and create tables"""
         try:
-            self.connection = await aiosqlite.connect(self.db_path)
+            self.connection = await self._connect()
+            if self.db_path != ":memory:":
+                await self._enable_incremental_vacuum()
             await self._create_tables()
+            
+            # WAL lets readers run next to the writer; an in-memory database cannot be shared
+            if self.db_path != ":memory:":
+                for _ in range(READER_CONNECTIONS):
+                    reader = await self._connect()
+                    await reader.execute("PRAGMA query_only=1")
+                    self.readers.append(reader)
+            self.next_reader = cycle(self.readers or [self.connection])
+            if self.readers:
+                self.fast_read_pool = ThreadPoolExecutor(
+                    max_workers=FAST_READ_WORKERS, thread_name_prefix="db-read"
+                )
+            self.maintenance_task = asyncio.create_task(self._maintenance_loop())
             logger.info("Database initialized successfully")
         except Exception as e:
-            logger.error(f"Database initialization failed: {e}")
+            logger.error("Database initialization failed: %s", e)
             raise
     
+    async def _connect(self) -> aiosqlite.Connection:
+        """Open a connection with the shared PRAGMAs applied"""
+        connection = await aiosqlite.connect(self.db_path, cached_statements=STATEMENT_CACHE_SIZE)
+        if self.db_path != ":memory:":
+            for pragma in CONNECTION_PRAGMAS:
+                await connection.execute(pragma)
+        return connection
+    
+    async def _enable_incremental_vacuum(self):
+        """Switch databases created without auto_vacuum over with a one-time VACUUM"""
+        cursor = await self.connection.execute("PRAGMA auto_vacuum")
+        row = await cursor.fetchone()
+        if row[0] != 2:  # 2 = INCREMENTAL
+            logger.info("Rebuilding database once to enable incremental vacuum")
+            await self.connection.execute("VACUUM")
+    
+    def _reader(self) -> aiosqlite.Connection:
+        """Pick the next read connection, round-robin"""
+        return next(self.next_reader)
+    
+    def _fast_read_connection(self) -> sqlite3.Connection:
+        """Get the calling worker thread's own read-only sqlite3 connection"""
+        connection = getattr(self.fast_read_local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.db_path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE
+            )
+            connection.execute("PRAGMA busy_timeout=5000")
+            connection.execute("PRAGMA query_only=1")
+            self.fast_read_local.connection = connection
+            self.fast_read_connections.append(connection)
+        return connection
+    
+    async def _fast_read(self, sql: str, params: tuple):
+        """Fetch one row on the shared read pool, bypassing aiosqlite's per-connection queue"""
+        if self.fast_read_pool is None:
+            cursor = await self._reader().execute(sql, params)
+            return await cursor.fetchone()
+        
+        return await asyncio.get_running_loop().run_in_executor(
+            self.fast_read_pool,
+            lambda: self._fast_read_connection().execute(sql, params).fetchone()
+        )
+    
+    def _shutdown_fast_reads(self, pool: ThreadPoolExecutor):
+        """Wait for the read pool to drain, then close its worker connections"""
+        pool.shutdown(wait=True)
+        for connection in self.fast_read_connections:
+            connection.close()
+        self.fast_read_connections.clear()
+    
     async def _create_tables(self):
         """Create necessary database tables"""
         tables = [
@@ -37,8 +331,8 @@ class Database:
                 id INTEGER PRIMARY KEY,
                 title TEXT NOT NULL,
                 settings TEXT DEFAULT '{}',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                updated_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
             )
             """,
             """
@@ -50,8 +344,8 @@ class Database:
                 is_admin BOOLEAN DEFAULT FALSE,
                 is_whitelisted BOOLEAN DEFAULT FALSE,
                 warnings INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER)),
+                updated_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
             )
             """,
             """
@@ -68,16 +362,6 @@ class Database:
             )
             """,
             """
-            CREATE TABLE IF NOT EXISTS flood_tracker (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                group_id INTEGER NOT NULL,
-                user_id INTEGER NOT NULL,
-                message_count INTEGER DEFAULT 1,
-                last_message_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                reset_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-            """,
-            """
             CREATE TABLE IF NOT EXISTS banned_keywords (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 group_id INTEGER NOT NULL,
@@ -90,41 +374,130 @@ class Database:
             """
             CREATE TABLE IF NOT EXISTS group_settings (
                 group_id INTEGER PRIMARY KEY,
-                text_filter_enabled BOOLEAN DEFAULT TRUE,
-                edit_monitor_enabled BOOLEAN DEFAULT TRUE,
-                media_filter_enabled BOOLEAN DEFAULT TRUE,
-                anti_flood_enabled BOOLEAN DEFAULT TRUE,
+                flags INTEGER DEFAULT 31,  -- DEFAULT_FLAGS
                 max_messages_per_minute INTEGER DEFAULT 10,
                 flood_threshold INTEGER DEFAULT 5,
-                auto_delete_enabled BOOLEAN DEFAULT TRUE,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                updated_at INTEGER DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
             )
             """
         ]
         
+        indexes = [
+            """
+            CREATE INDEX IF NOT EXISTS idx_mod_logs_group_ts 
+            ON moderation_logs (group_id, timestamp DESC)
+            """,
+            """
+            CREATE INDEX IF NOT EXISTS idx_mod_logs_ts 
+            ON moderation_logs (timestamp)
+            """
+        ]
+        
+        # Older databases kept one column per boolean setting; move them aside to repack below
+        cursor = await self.connection.execute("PRAGMA table_info(group_settings)")
+        columns = {row[1] for row in await cursor.fetchall()}
+        repack_settings = bool(columns) and 'flags' not in columns
+        if repack_settings:
+            await self.connection.execute("ALTER TABLE group_settings RENAME TO group_settings_old")
+        
         for table_sql in tables:
             await self.connection.execute(table_sql)
         
+        if repack_settings:
+            await self.connection.execute(
+                """INSERT INTO group_settings 
+                   (group_id, flags, max_messages_per_minute, flood_threshold, updated_at) 
+                   SELECT group_id, 
+                   (COALESCE(text_filter_enabled, 1) != 0) 
+                   | ((COALESCE(edit_monitor_enabled, 1) != 0) << 1) 
+                   | ((COALESCE(media_filter_enabled, 1) != 0) << 2) 
+                   | ((COALESCE(anti_flood_enabled, 1) != 0) << 3) 
+                   | ((COALESCE(auto_delete_enabled, 1) != 0) << 4), 
+                   max_messages_per_minute, flood_threshold, updated_at 
+                   FROM group_settings_old"""
+            )
+            await self.connection.execute("DROP TABLE group_settings_old")
+        
+        # Flood counters are kept in memory now; drop the table older databases created
+        await self.connection.execute("DROP TABLE IF EXISTS flood_tracker")
+        
+        for index_sql in indexes:
+            await self.connection.execute(index_sql)
+        
+        # Give the planner statistics, sampling large tables so startup stays fast
+        await self.connection.execute("PRAGMA analysis_limit=400")
+        await self.connection.execute("ANALYZE")
+        
         await self.connection.commit()
     
+    async def _maintenance_loop(self):
+        """Periodically checkpoint the WAL and refresh planner statistics"""
+        while True:
+            await asyncio.sleep(MAINTENANCE_INTERVAL)
+            try:
+                # Forget flood windows of users who went quiet
+                idle_cutoff = time.monotonic() - FLOOD_IDLE_TTL
+                idle = [
+                    key for key, times in self.flood_windows.items()
+                    if not times or times[-1] < idle_cutoff
+                ]
+                for key in idle:
+                    del self.flood_windows[key]
+                
+                await self.connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+                await self.connection.execute("PRAGMA optimize")
+            except aiosqlite.Error as e:
+                logger.error("Database maintenance failed: %s", e)
+    
+    def _commit_later(self):
+        """Make sure the pending writes are picked up by the next group commit"""
+        if self.commit_task is None:
+            self.commit_task = asyncio.create_task(self._group_commit())
+    
+    async def _commit(self):
+        """Wait until the pending writes have been committed with the current group"""
+        waiter = asyncio.get_running_loop().create_future()
+        self.commit_waiters.append(waiter)
+        if len(self.commit_waiters) >= COMMIT_BATCH_SIZE:
+            self.commit_full.set()
+        self._commit_later()
+        await waiter
+    
+    async def _group_commit(self):
+        """Commit every write issued during the last interval in one transaction"""
+        try:
+            await asyncio.wait_for(self.commit_full.wait(), COMMIT_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        
+        waiters, self.commit_waiters = self.commit_waiters, []
+        self.commit_full.clear()
+        self.commit_task = None
+        
+        try:
+            await self.connection.commit()
+        except Exception as e:
+            logger.error("Group commit failed: %s", e)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+        else:
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+    
     async def add_group(self, group_id: int, title: str) -> bool:
         """Add or update group in database"""
         try:
-            await self.connection.execute(
-                "INSERT OR REPLACE INTO groups (id, title, updated_at) VALUES (?, ?, ?)",
-                (group_id, title, datetime.utcnow())
-            )
+            await self.connection.execute(_SQL_ADD_GROUP, (group_id, title, int(time.time())))
             
             # Initialize group settings
-            await self.connection.execute(
-                "INSERT OR IGNORE INTO group_settings (group_id) VALUES (?)",
-                (group_id,)
-            )
+            await self.connection.execute(_SQL_INIT_SETTINGS, (group_id,))
             
-            await self.connection.commit()
+            await self._commit()
             return True
-        except Exception as e:
-            logger.error(f"Failed to add group {group_id}: {e}")
+        except aiosqlite.Error as e:
+            logger.error("Failed to add group %s: %s", group_id, e)
             return False
     
     async def add_user(self, user_id: int, first_name: str, last_name: str = None, 
@@ -132,15 +505,52 @@ class Database:
         """Add or update user in database"""
         try:
             await self.connection.execute(
-                """INSERT OR REPLACE INTO users 
-                   (id, first_name, last_name, username, is_admin, updated_at) 
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (user_id, first_name, last_name, username, is_admin, datetime.utcnow())
+                _SQL_ADD_USER,
+                (user_id, first_name, last_name, username, is_admin, int(time.time()))
             )
-            await self.connection.commit()
+            await self._commit()
             return True
-        except Exception as e:
-            logger.error(f"Failed to add user {user_id}: {e}")
+        except aiosqlite.Error as e:
+            logger.error("Failed to add user %s: %s", user_id, e)
+            return False
+    
+    async def add_groups(self, rows: List[tuple]) -> bool:
+        """
+        Add or update several groups in one statement batch
+        Rows: (group_id, title); later rows for the same group win
+        """
+        groups = {group_id: title for group_id, title in rows}
+        if not groups:
+            return True
+        
+        try:
+            now = int(time.time())
+            await self.connection.executemany(
+                _SQL_ADD_GROUP, [(group_id, title, now) for group_id, title in groups.items()]
+            )
+            await self.connection.executemany(_SQL_INIT_SETTINGS, [(group_id,) for group_id in groups])
+            await self._commit()
+            return True
+        except aiosqlite.Error as e:
+            logger.error("Failed to add %s groups: %s", len(groups), e)
+            return False
+    
+    async def add_users(self, rows: List[tuple]) -> bool:
+        """
+        Add or update several users in one statement batch
+        Rows: (user_id, first_name, last_name, username, is_admin); later rows for the same user win
+        """
+        users = {row[0]: row for row in rows}
+        if not users:
+            return True
+        
+        try:
+            now = int(time.time())
+            await self.connection.executemany(_SQL_ADD_USER, [row + (now,) for row in users.values()])
+            await self._commit()
+            return True
+        except aiosqlite.Error as e:
+            logger.error("Failed to add %s users: %s", len(users), e)
             return False
     
     async def log_moderation_action(self, group_id: int, user_id: int, action: str,
@@ -149,182 +559,270 @@ class Database:
         """Log moderation action"""
         try:
             await self.connection.execute(
-                """INSERT INTO moderation_logs 
-                   (group_id, user_id, action, reason, original_message, edited_message, message_id)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                _SQL_LOG_MOD,
                 (group_id, user_id, action, reason, original_message, edited_message, message_id)
             )
-            await self.connection.commit()
+            await self._commit()
             return True
-        except Exception as e:
-            logger.error(f"Failed to log moderation action: {e}")
+        except aiosqlite.Error as e:
+            logger.error("Failed to log moderation action: %s", e)
+            return False
+    
+    async def log_moderation_actions(self, rows: List[tuple]) -> bool:
+        """
+        Log several moderation actions in one statement batch
+        Rows: (group_id, user_id, action, reason, original_message, edited_message, message_id)
+        """
+        if not rows:
+            return True
+        
+        try:
+            await self.connection.executemany(_SQL_LOG_MOD, rows)
+            await self._commit()
+            return True
+        except aiosqlite.Error as e:
+            logger.error("Failed to log %s moderation actions: %s", len(rows), e)
             return False
     
     async def get_group_settings(self, group_id: int) -> Dict[str, Any]:
         """Get group settings"""
+        cached = self.settings_cache.get(group_id)
+        if cached is not None:
+            self.settings_cache.move_to_end(group_id)
+            return dict(cached)
+        
+        settings = await self._load_group_settings(group_id)
+        if settings:
+            self._cache_settings(group_id, settings)
+        return dict(settings)
+    
+    def _cache_settings(self, group_id: int, settings: Dict[str, Any]):
+        """Store settings in the LRU cache, evicting the least recently used group"""
+        self.settings_cache[group_id] = settings
+        self.settings_cache.move_to_end(group_id)
+        if len(self.settings_cache) > SETTINGS_CACHE_SIZE:
+            self.settings_cache.popitem(last=False)
+    
+    async def _load_group_settings(self, group_id: int) -> Dict[str, Any]:
+        """Read group settings from the database"""
         try:
-            cursor = await self.connection.execute(
-                "SELECT * FROM group_settings WHERE group_id = ?", (group_id,)
-            )
-            row = await cursor.fetchone()
+            row = await self._fast_read(_SQL_GET_SETTINGS, (group_id,))
             
             if row:
-                return {
-                    'text_filter_enabled': bool(row[1]),
-                    'edit_monitor_enabled': bool(row[2]),
-                    'media_filter_enabled': bool(row[3]),
-                    'anti_flood_enabled': bool(row[4]),
-                    'max_messages_per_minute': row[5],
-                    'flood_threshold': row[6],
-                    'auto_delete_enabled': bool(row[7])
-                }
+                return self._settings_from_row(row)
             else:
                 # Return default settings
-                return {
-                    'text_filter_enabled': True,
-                    'edit_monitor_enabled': True,
-                    'media_filter_enabled': True,
-                    'anti_flood_enabled': True,
-                    'max_messages_per_minute': 10,
-                    'flood_threshold': 5,
-                    'auto_delete_enabled': True
-                }
-        except Exception as e:
-            logger.error(f"Failed to get group settings for {group_id}: {e}")
+                return dict(DEFAULT_SETTINGS)
+        except aiosqlite.Error as e:
+            logger.error("Failed to get group settings for %s: %s", group_id, e)
+            return {}
+    
+    def _settings_from_row(self, row) -> Dict[str, Any]:
+        """Convert a group_settings row into a settings dict"""
+        flags, max_messages_per_minute, flood_threshold = row
+        return {
+            'text_filter_enabled': bool(flags & FLAG_TEXT_FILTER),
+            'edit_monitor_enabled': bool(flags & FLAG_EDIT_MONITOR),
+            'media_filter_enabled': bool(flags & FLAG_MEDIA_FILTER),
+            'anti_flood_enabled': bool(flags & FLAG_ANTI_FLOOD),
+            'max_messages_per_minute': max_messages_per_minute,
+            'flood_threshold': flood_threshold,
+            'auto_delete_enabled': bool(flags & FLAG_AUTO_DELETE),
+            'locked': bool(flags & FLAG_LOCKED)
+        }
+    
+    def _settings_to_row(self, settings: Dict[str, Any]) -> tuple:
+        """Pack a settings dict into (flags, max_messages_per_minute, flood_threshold)"""
+        merged = {**DEFAULT_SETTINGS, **settings}
+        flags = 0
+        for key, flag in SETTING_FLAGS.items():
+            if merged[key]:
+                flags |= flag
+        return (flags,) + _settings_numbers(merged)
+    
+    async def toggle_group_setting(self, group_id: int, setting_key: str) -> Dict[str, Any]:
+        """Flip a boolean group setting and return the updated settings"""
+        if setting_key not in TOGGLEABLE_SETTINGS:
+            raise ValueError(f"Unknown toggle setting: {setting_key}")
+        
+        try:
+            flag = SETTING_FLAGS[setting_key]
+            cursor = await self.connection.execute(
+                _SQL_TOGGLE_SETTING, (group_id, DEFAULT_FLAGS ^ flag, int(time.time()), flag, flag)
+            )
+            row = await cursor.fetchone()
+            await self._commit()
+            
+            settings = self._settings_from_row(row)
+            self._cache_settings(group_id, settings)
+            return dict(settings)
+            
+        except aiosqlite.Error as e:
+            logger.error("Failed to toggle %s for %s: %s", setting_key, group_id, e)
+            return {}
+    
+    async def set_group_setting(self, group_id: int, setting_key: str, value: bool) -> Dict[str, Any]:
+        """Set a boolean group setting and return the updated settings"""
+        if setting_key not in SETTING_FLAGS:
+            raise ValueError(f"Unknown boolean setting: {setting_key}")
+        
+        try:
+            flag = SETTING_FLAGS[setting_key]
+            bit = flag if value else 0
+            cursor = await self.connection.execute(
+                _SQL_SET_SETTING,
+                (group_id, (DEFAULT_FLAGS & ~flag) | bit, int(time.time()), ~flag, bit)
+            )
+            row = await cursor.fetchone()
+            await self._commit()
+            
+            settings = self._settings_from_row(row)
+            self._cache_settings(group_id, settings)
+            return dict(settings)
+            
+        except aiosqlite.Error as e:
+            self.settings_cache.pop(group_id, None)
+            logger.error("Failed to set %s for %s: %s", setting_key, group_id, e)
             return {}
     
     async def update_group_settings(self, group_id: int, settings: Dict[str, Any]) -> bool:
         """Update group settings"""
+        values = self._settings_to_row(settings)
+        
         try:
-            await self.connection.execute(
-                """UPDATE group_settings SET 
-                   text_filter_enabled = ?, edit_monitor_enabled = ?, media_filter_enabled = ?,
-                   anti_flood_enabled = ?, max_messages_per_minute = ?, flood_threshold = ?,
-                   auto_delete_enabled = ?, updated_at = ?
-                   WHERE group_id = ?""",
-                (
-                    settings.get('text_filter_enabled', True),
-                    settings.get('edit_monitor_enabled', True),
-                    settings.get('media_filter_enabled', True),
-                    settings.get('anti_flood_enabled', True),
-                    settings.get('max_messages_per_minute', 10),
-                    settings.get('flood_threshold', 5),
-                    settings.get('auto_delete_enabled', True),
-                    datetime.utcnow(),
-                    group_id
-                )
+            cursor = await self.connection.execute(
+                _SQL_UPDATE_SETTINGS,
+                values + (int(time.time()), group_id)
             )
-            await self.connection.commit()
+            await self._commit()
+            
+            # Only an existing row was updated; otherwise drop any cached defaults
+            if cursor.rowcount:
+                updated = self._settings_from_row(values)
+                self._cache_settings(group_id, updated)
+                self.flood_thresholds[group_id] = updated['flood_threshold']
+            else:
+                self.settings_cache.pop(group_id, None)
+                self.flood_thresholds.pop(group_id, None)
             return True
-        except Exception as e:
-            logger.error(f"Failed to update group settings for {group_id}: {e}")
+        except aiosqlite.Error as e:
+            self.settings_cache.pop(group_id, None)
+            self.flood_thresholds.pop(group_id, None)
+            logger.error("Failed to update group settings for %s: %s", group_id, e)
             return False
     
     async def check_flood(self, group_id: int, user_id: int) -> bool:
         """Check if user is flooding and update counter"""
         try:
-            now = datetime.utcnow()
-            reset_time = now - timedelta(seconds=60)  # 1 minute window
+            now = time.monotonic()
+            window_start = now - FLOOD_WINDOW
             
-            # Clean old flood records
-            await self.connection.execute(
-                "DELETE FROM flood_tracker WHERE reset_time < ?", (reset_time,)
-            )
+            times = self.flood_windows.get((group_id, user_id))
+            if times is None:
+                times = self.flood_windows[(group_id, user_id)] = deque()
+            times.append(now)
+            while times[0] < window_start:
+                times.popleft()
             
-            # Get current flood record
-            cursor = await self.connection.execute(
-                "SELECT message_count, last_message_time FROM flood_tracker WHERE group_id = ? AND user_id = ?",
-                (group_id, user_id)
-            )
-            row = await cursor.fetchone()
+            # Check flood threshold
+            flood_threshold = self.flood_thresholds.get(group_id)
+            if flood_threshold is None:
+                row = await self._fast_read(_SQL_GET_FLOOD_THRESHOLD, (group_id,))
+                flood_threshold = self.flood_thresholds[group_id] = row[0] if row else 5
             
-            if row:
-                message_count, last_message_time = row
-                last_time = datetime.fromisoformat(last_message_time)
-                
-                # If within flood timeframe, increment counter
-                if (now - last_time).total_seconds() < 60:
-                    message_count += 1
-                    await self.connection.execute(
-                        "UPDATE flood_tracker SET message_count = ?, last_message_time = ? WHERE group_id = ? AND user_id = ?",
-                        (message_count, now, group_id, user_id)
-                    )
-                else:
-                    # Reset counter
-                    message_count = 1
-                    await self.connection.execute(
-                        "UPDATE flood_tracker SET message_count = 1, last_message_time = ?, reset_time = ? WHERE group_id = ? AND user_id = ?",
-                        (now, now, group_id, user_id)
-                    )
-            else:
-                # First message from user
-                message_count = 1
-                await self.connection.execute(
-                    "INSERT INTO flood_tracker (group_id, user_id, message_count, last_message_time, reset_time) VALUES (?, ?, 1, ?, ?)",
-                    (group_id, user_id, now, now)
-                )
+            # Only the newest flood_threshold messages can matter
+            while len(times) > flood_threshold:
+                times.popleft()
             
-            await self.connection.commit()
+            return len(times) >= flood_threshold
             
-            # Check flood threshold
-            settings = await self.get_group_settings(group_id)
-            flood_threshold = settings.get('flood_threshold', 5)
+        except aiosqlite.Error as e:
+            logger.error("Failed to check flood for user %s: %s", user_id, e)
+            return False
+    
+    async def iter_moderation_logs(self, group_id: int, limit: int = 100) -> AsyncIterator[Dict]:
+        """Stream recent moderation logs, newest first, without materializing every row"""
+        try:
+            cursor = await self._reader().execute(_SQL_GET_LOGS, (group_id, limit))
+            cursor.row_factory = aiosqlite.Row
             
-            return message_count >= flood_threshold
+            async for row in cursor:
+                yield dict(row)
             
-        except Exception as e:
-            logger.error(f"Failed to check flood for user {user_id}: {e}")
-            return False
+        except aiosqlite.Error as e:
+            logger.error("Failed to get moderation logs: %s", e)
     
     async def get_moderation_logs(self, group_id: int, limit: int = 100) -> List[Dict]:
         """Get recent moderation logs"""
+        return [log async for log in self.iter_moderation_logs(group_id, limit)]
+    
+    async def get_recent_actions(self, group_id: int, limit: int = 10) -> List[Dict]:
+        """Get action, user name and timestamp of the most recent moderation logs"""
         try:
-            cursor = await self.connection.execute(
-                """SELECT ml.*, u.first_name, u.username 
-                   FROM moderation_logs ml 
-                   LEFT JOIN users u ON ml.user_id = u.id 
-                   WHERE ml.group_id = ? 
-                   ORDER BY ml.timestamp DESC 
-                   LIMIT ?""",
-                (group_id, limit)
-            )
+            cursor = await self._reader().execute(_SQL_RECENT_ACTIONS, (group_id, limit))
             rows = await cursor.fetchall()
             
-            logs = []
-            for row in rows:
-                logs.append({
-                    'id': row[0],
-                    'group_id': row[1],
-                    'user_id': row[2],
-                    'action': row[3],
-                    'reason': row[4],
-                    'original_message': row[5],
-                    'edited_message': row[6],
-                    'message_id': row[7],
-                    'timestamp': row[8],
-                    'user_name': row[9],
-                    'username': row[10]
-                })
-            
-            return logs
+            return [
+                {'action': row[0], 'timestamp': row[1], 'user_name': row[2]}
+                for row in rows
+            ]
             
-        except Exception as e:
-            logger.error(f"Failed to get moderation logs: {e}")
+        except aiosqlite.Error as e:
+            logger.error("Failed to get recent actions: %s", e)
             return []
     
+    async def get_recent_action_counts(self, group_id: int, limit: int = 100) -> Dict[str, int]:
+        """Count actions among the most recent moderation logs of a group"""
+        try:
+            cursor = await self._reader().execute(_SQL_ACTION_COUNTS, (group_id, limit))
+            rows = await cursor.fetchall()
+            
+            return {action: count for action, count in rows}
+            
+        except aiosqlite.Error as e:
+            logger.error("Failed to get action counts: %s", e)
+            return {}
+    
     async def cleanup_old_logs(self, days: int = 30):
         """Clean up old moderation logs"""
         try:
-            cutoff_date = datetime.utcnow() - timedelta(days=days)
-            await self.connection.execute(
-                "DELETE FROM moderation_logs WHERE timestamp < ?", (cutoff_date,)
-            )
-            await self.connection.commit()
-            logger.info(f"Cleaned up logs older than {days} days")
-        except Exception as e:
-            logger.error(f"Failed to cleanup old logs: {e}")
+            # Log timestamps are CURRENT_TIMESTAMP text, which sorts like this UTC string
+            cutoff_date = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(time.time() - days * 86400))
+            cursor = await self.connection.execute(_SQL_CLEANUP_BOUNDARY, (cutoff_date,))
+            row = await cursor.fetchone()
+            last_id = row[0] if row else None
+            
+            # Delete the expired id range in batches so writers are never blocked for long
+            while last_id is not None:
+                cursor = await self.connection.execute(
+                    _SQL_CLEANUP_BATCH, (last_id, CLEANUP_BATCH_SIZE)
+                )
+                await self._commit()
+                if cursor.rowcount < CLEANUP_BATCH_SIZE:
+                    break
+            
+            # Return the freed pages; executescript steps the PRAGMA until it is done
+            await self.connection.executescript(f"PRAGMA incremental_vacuum({VACUUM_PAGES})")
+            
+            logger.info("Cleaned up logs older than %s days", days)
+        except aiosqlite.Error as e:
+            logger.error("Failed to cleanup old logs: %s", e)
     
     async def close(self):
         """Close database connection"""
+        if self.maintenance_task:
+            self.maintenance_task.cancel()
+        if self.commit_task:
+            self.commit_task.cancel()
+        if self.fast_read_pool:
+            # Drain in-flight reads off the event loop; new reads fall back to the readers
+            pool, self.fast_read_pool = self.fast_read_pool, None
+            await asyncio.to_thread(self._shutdown_fast_reads, pool)
+        for reader in self.readers:
+            await reader.close()
         if self.connection:
+            await self.connection.commit()
+            for waiter in self.commit_waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
             await self.connection.close()
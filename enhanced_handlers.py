@@ -3,19 +3,21 @@ Enhanced Message handlers for Telegram Protection Bot
 Integrates all advanced security and moderation features
 """
 
+import time
 import asyncio
 import logging
-from datetime import datetime, timedelta
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Coroutine, Dict, Optional, Set, Tuple
 from pyrogram.client import Client
 from pyrogram import filters
 from pyrogram.types import Message, CallbackQuery, ChatMemberUpdated
 from pyrogram.enums import ChatMemberStatus
-from database import Database
+from database import BatchWriter, Database
 from filters import ContentFilter
 from config import Config
 from logger import BotLogger
 from admin import AdminPanel
-from utils import is_admin, get_user_info, format_user_mention, safe_ban_user, safe_restrict_user
+from utils import DelayedDeleter, is_admin, get_user_info, format_user_mention, safe_ban_user, safe_restrict_user
 from captcha import CaptchaSystem
 from anti_spam import AntiSpamSystem
 from gban_system import GBanSystem
@@ -24,6 +26,30 @@ from welcome_system import WelcomeSystem
 
 logger = logging.getLogger(__name__)
 
+# Admin status, roles and permissions are reused for this long per (chat, user)
+MEMBER_CACHE_TTL = 60  # seconds
+MEMBER_CACHE_SIZE = 10000
+
+# Composite filters shared by the handler registrations
+GROUP_TEXT = filters.group & filters.text & ~filters.bot
+GROUP_MEDIA = filters.group & filters.media & ~filters.bot
+GROUP_NON_BOT = filters.group & ~filters.bot
+PRIVATE_START = filters.command("start") & filters.private
+
+# Recent messages remembered for edit monitoring
+MESSAGE_TRACKER_SIZE = 1000
+
+# Delayed deletions due within one tick are sent together, one call per chat
+DELETE_TICK = 0.1  # seconds
+
+class _MockMessage:
+    """Minimal message stand-in for the welcome system on member updates"""
+    __slots__ = ("chat", "from_user")
+    
+    def __init__(self, chat, user):
+        self.chat = chat
+        self.from_user = user
+
 class EnhancedHandlers:
     """Enhanced message handling system with all protection features"""
     
@@ -38,16 +64,28 @@ class EnhancedHandlers:
         self.bot_logger = BotLogger(db)
         self.admin_panel = AdminPanel(client, db, self.content_filter)
         
+        # Batched delayed deletion of notifications, shared with the anti-spam and gban systems
+        self.deleter = DelayedDeleter(client, batch_delay=DELETE_TICK)
+        
         # Initialize advanced systems
         self.captcha_system = CaptchaSystem(client, db)
-        self.anti_spam_system = AntiSpamSystem(client, db)
-        self.gban_system = GBanSystem(client, db)
+        self.anti_spam_system = AntiSpamSystem(client, db, self.deleter)
+        self.gban_system = GBanSystem(client, db, self.deleter)
         self.role_system = RoleSystem(client, db)
         self.welcome_system = WelcomeSystem(client, db, self.captcha_system)
         
         # Group state management
-        self.locked_chats = set()
-        self.message_tracker = {}
+        self.message_tracker: OrderedDict[int, Dict[str, Any]] = OrderedDict()
+        
+        # Group and user upserts from the message path are written in batches
+        self.group_writer = BatchWriter(db.add_groups)
+        self.user_writer = BatchWriter(db.add_users)
+        
+        # (chat_id, user_id, lookup...) -> (expires_at, value)
+        self.member_cache: Dict[Tuple, Tuple[float, Any]] = {}
+        
+        # Fire-and-forget notifications, referenced until done so they are not collected
+        self.background_tasks: Set[asyncio.Task] = set()
         
         self.register_handlers()
     
@@ -55,12 +93,12 @@ class EnhancedHandlers:
         """Register all message handlers"""
         
         # Text message handler
-        @self.client.on_message(filters.group & filters.text & ~filters.bot)
+        @self.client.on_message(GROUP_TEXT)
         async def handle_text_message(client: Client, message: Message):
             await self._handle_text_message(message)
         
         # Media message handler
-        @self.client.on_message(filters.group & filters.media & ~filters.bot)
+        @self.client.on_message(GROUP_MEDIA)
         async def handle_media_message(client: Client, message: Message):
             await self._handle_media_message(message)
         
@@ -75,58 +113,76 @@ class EnhancedHandlers:
             await self._handle_callback_query(callback_query)
         
         # Edit message handler
-        @self.client.on_edited_message(filters.group & ~filters.bot)
+        @self.client.on_edited_message(GROUP_NON_BOT)
         async def handle_edited_message(client: Client, message: Message):
             await self._handle_edited_message(message)
         
-        # Command handlers
-        @self.client.on_message(filters.command("start") & filters.private)
-        async def start_command(client: Client, message: Message):
+        # /start only answers in private chats
+        @self.client.on_message(PRIVATE_START)
+        async def handle_start(client: Client, message: Message):
             await self._handle_start_command(message)
         
-        @self.client.on_message(filters.command("help"))
-        async def help_command(client: Client, message: Message):
-            await self._handle_help_command(message)
-        
-        @self.client.on_message(filters.command(["gban", "globan"]))
-        async def gban_command(client: Client, message: Message):
-            await self._handle_gban_command(message)
-        
-        @self.client.on_message(filters.command(["ungban", "ungloban"]))
-        async def ungban_command(client: Client, message: Message):
-            await self._handle_ungban_command(message)
-        
-        @self.client.on_message(filters.command("lock"))
-        async def lock_command(client: Client, message: Message):
-            await self._handle_lock_command(message)
-        
-        @self.client.on_message(filters.command("unlock"))
-        async def unlock_command(client: Client, message: Message):
-            await self._handle_unlock_command(message)
-        
-        @self.client.on_message(filters.command("promote"))
-        async def promote_command(client: Client, message: Message):
-            await self._handle_promote_command(message)
-        
-        @self.client.on_message(filters.command("demote"))
-        async def demote_command(client: Client, message: Message):
-            await self._handle_demote_command(message)
-        
-        @self.client.on_message(filters.command("mute"))
-        async def mute_command(client: Client, message: Message):
-            await self._handle_mute_command(message)
-        
-        @self.client.on_message(filters.command("unmute"))
-        async def unmute_command(client: Client, message: Message):
-            await self._handle_unmute_command(message)
-        
-        @self.client.on_message(filters.command("setwelcome"))
-        async def setwelcome_command(client: Client, message: Message):
-            await self._handle_setwelcome_command(message)
-        
-        @self.client.on_message(filters.command("welcome"))
-        async def welcome_command(client: Client, message: Message):
-            await self._handle_welcome_settings_command(message)
+        # Every other command goes through one filter and a dict lookup
+        self.command_table: Dict[str, Callable[[Message], Awaitable[None]]] = {
+            "help": self._handle_help_command,
+            "gban": self._handle_gban_command,
+            "globan": self._handle_gban_command,
+            "ungban": self._handle_ungban_command,
+            "ungloban": self._handle_ungban_command,
+            "lock": self._handle_lock_command,
+            "unlock": self._handle_unlock_command,
+            "promote": self._handle_promote_command,
+            "demote": self._handle_demote_command,
+            "mute": self._handle_mute_command,
+            "unmute": self._handle_unmute_command,
+            "setwelcome": self._handle_setwelcome_command,
+            "welcome": self._handle_welcome_settings_command,
+        }
+        
+        @self.client.on_message(filters.command(list(self.command_table)))
+        async def handle_command(client: Client, message: Message):
+            await self.command_table[message.command[0]](message)
+    
+    async def _cached(self, key: Tuple, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Return a fresh cached member lookup or fetch and cache it"""
+        now = time.monotonic()
+        cached = self.member_cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+        
+        value = await fetch()
+        
+        # Evict the oldest entry when full
+        self.member_cache.pop(key, None)
+        if len(self.member_cache) >= MEMBER_CACHE_SIZE:
+            del self.member_cache[next(iter(self.member_cache))]
+        self.member_cache[key] = (now + MEMBER_CACHE_TTL, value)
+        
+        return value
+    
+    async def _cached_is_admin(self, chat_id: int, user_id: int) -> bool:
+        """Check admin status through the member cache"""
+        return await self._cached(
+            (chat_id, user_id, 'is_admin'), lambda: is_admin(self.client, chat_id, user_id)
+        )
+    
+    async def _cached_role(self, chat_id: int, user_id: int) -> UserRole:
+        """Get a user's role through the member cache"""
+        return await self._cached(
+            (chat_id, user_id, 'role'), lambda: self.role_system.get_user_role(chat_id, user_id)
+        )
+    
+    async def _cached_perm(self, chat_id: int, user_id: int, permission: str) -> bool:
+        """Check a permission through the member cache"""
+        return await self._cached(
+            (chat_id, user_id, 'perm', permission),
+            lambda: self.role_system.has_permission(chat_id, user_id, permission)
+        )
+    
+    def _invalidate_member(self, chat_id: int, user_id: int):
+        """Drop every cached lookup for a user after their status or role changed"""
+        for key in [key for key in self.member_cache if key[0] == chat_id and key[1] == user_id]:
+            del self.member_cache[key]
     
     async def _handle_text_message(self, message: Message):
         """Handle text messages with all protection features"""
@@ -134,39 +190,46 @@ class EnhancedHandlers:
             chat_id = message.chat.id
             user_id = message.from_user.id
             
-            # Add group and user to database
-            await self.db.add_group(chat_id, message.chat.title)
+            # Independent lookups run concurrently; the checks below still apply in order
+            user_is_admin, gban_entry, can_send, settings = await asyncio.gather(
+                self._cached_is_admin(chat_id, user_id),
+                self.gban_system.check_user_gban(user_id),
+                self._cached_perm(chat_id, user_id, 'send_messages'),
+                self.db.get_group_settings(chat_id)
+            )
+            
+            # Queue group and user upserts for the next batch
+            self.group_writer.submit((chat_id, message.chat.title))
             user_info = get_user_info(message.from_user)
-            await self.db.add_user(
+            self.user_writer.submit((
                 user_info['id'], user_info['first_name'], 
                 user_info['last_name'], user_info['username'],
-                await is_admin(self.client, chat_id, user_id)
-            )
+                user_is_admin
+            ))
             
             # Check if chat is locked
-            if chat_id in self.locked_chats:
-                user_role = await self.role_system.get_user_role(chat_id, user_id)
+            if settings.get('locked'):
+                user_role = await self._cached_role(chat_id, user_id)
                 if user_role not in [UserRole.OWNER, UserRole.ADMIN]:
                     await message.delete()
                     return
             
             # Check global ban
-            gban_entry = await self.gban_system.check_user_gban(user_id)
             if gban_entry:
                 await safe_ban_user(self.client, chat_id, user_id)
                 await message.delete()
                 
-                notification = await self.client.send_message(
+                self._spawn(self._notify_and_delete(
                     chat_id,
                     f"🚫 **Global Ban Detected**\n"
                     f"User {format_user_mention(message.from_user)} was globally banned.\n"
-                    f"Reason: {gban_entry.reason}"
-                )
-                asyncio.create_task(self._delete_after(chat_id, notification.id, 30))
+                    f"Reason: {gban_entry.reason}",
+                    30
+                ))
                 return
             
             # Check user permissions
-            if not await self.role_system.has_permission(chat_id, user_id, 'send_messages'):
+            if not can_send:
                 await message.delete()
                 return
             
@@ -177,8 +240,7 @@ class EnhancedHandlers:
                 return
             
             # Content filtering
-            settings = await self.db.get_group_settings(chat_id)
-            if settings.get('text_filter_enabled', True):
+            if settings.get('text_filter_enabled', True) and self.content_filter.maybe_contains_banned(message.text):
                 is_banned, categories, keywords = self.content_filter.check_text_content(message.text)
                 
                 if is_banned:
@@ -190,14 +252,13 @@ class EnhancedHandlers:
                 'original_text': message.text,
                 'chat_id': chat_id,
                 'user_id': user_id,
-                'timestamp': datetime.utcnow()
+                'timestamp': time.monotonic()
             }
+            self.message_tracker.move_to_end(message.id)
             
-            # Auto-delete old tracked messages (keep last 1000)
-            if len(self.message_tracker) > 1000:
-                old_keys = list(self.message_tracker.keys())[:-1000]
-                for key in old_keys:
-                    del self.message_tracker[key]
+            # Forget the oldest tracked message once over the limit
+            if len(self.message_tracker) > MESSAGE_TRACKER_SIZE:
+                self.message_tracker.popitem(last=False)
         
         except Exception as e:
             self.logger.error(f"Error handling text message: {e}")
@@ -217,13 +278,14 @@ class EnhancedHandlers:
             else:
                 media_permission = 'send_media'
             
-            if not await self.role_system.has_permission(chat_id, user_id, media_permission):
+            if not await self._cached_perm(chat_id, user_id, media_permission):
                 await message.delete()
                 return
             
             # Check if chat is locked
-            if chat_id in self.locked_chats:
-                user_role = await self.role_system.get_user_role(chat_id, user_id)
+            settings = await self.db.get_group_settings(chat_id)
+            if settings.get('locked'):
+                user_role = await self._cached_role(chat_id, user_id)
                 if user_role not in [UserRole.OWNER, UserRole.ADMIN]:
                     await message.delete()
                     return
@@ -246,6 +308,7 @@ class EnhancedHandlers:
             chat_id = update.chat.id
             new_member = update.new_chat_member
             old_member = update.old_chat_member
+            self._invalidate_member(chat_id, new_member.user.id)
             
             # Handle new member join
             if (old_member.status in [ChatMemberStatus.LEFT, ChatMemberStatus.BANNED] and 
@@ -258,12 +321,7 @@ class EnhancedHandlers:
                     return  # User was gbanned and removed
                 
                 # Create a mock message object for welcome system compatibility
-                class MockMessage:
-                    def __init__(self, chat, user):
-                        self.chat = chat
-                        self.from_user = user
-                
-                mock_message = MockMessage(update.chat, new_member.user)
+                mock_message = _MockMessage(update.chat, new_member.user)
                 await self.welcome_system.handle_new_member(mock_message, [new_member])
             
             # Handle member leave
@@ -271,7 +329,7 @@ class EnhancedHandlers:
                   new_member.status in [ChatMemberStatus.LEFT, ChatMemberStatus.BANNED]):
                 
                 # Create mock message for farewell
-                mock_message = MockMessage(update.chat, old_member.user)
+                mock_message = _MockMessage(update.chat, old_member.user)
                 await self.welcome_system.handle_member_left(mock_message, old_member)
         
         except Exception as e:
@@ -304,14 +362,14 @@ class EnhancedHandlers:
                 await message.delete()
                 
                 # Log the violation
-                await self.bot_logger.log_violation(
+                self.bot_logger.queue_violation(
                     message.chat.id, message.from_user.id,
                     "Edit attempt", f"Original: {original_data['original_text'][:100]}"
                 )
                 return
             
             # Check edited content
-            if message.text:
+            if self.content_filter.maybe_contains_banned(message.text):
                 is_banned, categories, keywords = self.content_filter.check_text_content(message.text)
                 if is_banned:
                     await self._handle_content_violation(message, categories, keywords)
@@ -326,7 +384,7 @@ class EnhancedHandlers:
             await message.delete()
             
             # Log the spam detection
-            await self.bot_logger.log_violation(
+            self.bot_logger.queue_violation(
                 message.chat.id, message.from_user.id,
                 "Spam detected", f"Score: {spam_result['score']}, Reasons: {spam_result['reasons']}"
             )
@@ -335,16 +393,17 @@ class EnhancedHandlers:
             if spam_result['score'] > 90:
                 # High spam - ban user
                 await safe_ban_user(self.client, message.chat.id, message.from_user.id)
-                await self.client.send_message(
+                self._spawn(self._notify_and_delete(
                     message.chat.id,
                     f"🚫 {format_user_mention(message.from_user)} has been banned for severe spam."
-                )
+                ))
             elif spam_result['score'] > 70:
                 # Medium spam - mute user
                 await self.role_system.mute_user(
                     message.chat.id, message.from_user.id, 
                     0, 24, "Spam detection"  # 24 hour mute
                 )
+                self._invalidate_member(message.chat.id, message.from_user.id)
         
         except Exception as e:
             self.logger.error(f"Error handling spam detection: {e}")
@@ -355,21 +414,19 @@ class EnhancedHandlers:
             await message.delete()
             
             # Log the violation
-            await self.bot_logger.log_violation(
+            self.bot_logger.queue_violation(
                 message.chat.id, message.from_user.id,
                 f"Content violation: {', '.join(categories)}",
                 f"Keywords: {', '.join(keywords[:5])}"  # Log first 5 keywords
             )
             
-            # Send warning message
-            warning_msg = await self.client.send_message(
+            # Send warning message, auto-deleted after 10 seconds
+            self._spawn(self._notify_and_delete(
                 message.chat.id,
                 f"⚠️ {format_user_mention(message.from_user)}, your message was removed "
-                f"for violating community guidelines."
-            )
-            
-            # Auto-delete warning after 10 seconds
-            asyncio.create_task(self._delete_after(message.chat.id, warning_msg.id, 10))
+                f"for violating community guidelines.",
+                10
+            ))
         
         except Exception as e:
             self.logger.error(f"Error handling content violation: {e}")
@@ -433,19 +490,21 @@ class EnhancedHandlers:
         
         if message.reply_to_message:
             target_user = message.reply_to_message.from_user
-            reason = message.text.split(maxsplit=1)[1] if len(message.text.split()) > 1 else "No reason provided"
+            parts = message.text.split(maxsplit=1)
+            reason = parts[1] if len(parts) > 1 else "No reason provided"
         else:
-            args = message.text.split()[1:]
-            if len(args) < 2:
+            # /gban <user_id> <reason...>
+            parts = message.text.split(maxsplit=2)
+            if len(parts) < 3:
                 await message.reply_text("Usage: /gban <user_id> <reason> or reply to a message with /gban <reason>")
                 return
             
             try:
-                target_user_id = int(args[0])
+                target_user_id = int(parts[1])
                 target_user = await self.client.get_users(target_user_id)
                 if isinstance(target_user, list):
                     target_user = target_user[0] if target_user else None
-                reason = " ".join(args[1:])
+                reason = parts[2]
             except:
                 await message.reply_text("❌ Invalid user ID.")
                 return
@@ -475,7 +534,7 @@ class EnhancedHandlers:
         if message.reply_to_message:
             target_user_id = message.reply_to_message.from_user.id
         else:
-            args = message.text.split()[1:]
+            args = message.text.split(maxsplit=2)[1:]
             if len(args) < 1:
                 await message.reply_text("Usage: /ungban <user_id> or reply to a message with /ungban")
                 return
@@ -499,8 +558,10 @@ class EnhancedHandlers:
             await message.reply_text("❌ You don't have permission to lock the group.")
             return
         
-        self.locked_chats.add(message.chat.id)
-        await message.reply_text("🔒 Group locked. Only admins can send messages.")
+        if await self.db.set_group_setting(message.chat.id, 'locked', True):
+            await message.reply_text("🔒 Group locked. Only admins can send messages.")
+        else:
+            await message.reply_text("❌ Failed to lock the group.")
     
     async def _handle_unlock_command(self, message: Message):
         """Handle /unlock command"""
@@ -508,8 +569,10 @@ class EnhancedHandlers:
             await message.reply_text("❌ You don't have permission to unlock the group.")
             return
         
-        self.locked_chats.discard(message.chat.id)
-        await message.reply_text("🔓 Group unlocked. All members can send messages.")
+        if await self.db.set_group_setting(message.chat.id, 'locked', False):
+            await message.reply_text("🔓 Group unlocked. All members can send messages.")
+        else:
+            await message.reply_text("❌ Failed to unlock the group.")
     
     async def _handle_promote_command(self, message: Message):
         """Handle /promote command"""
@@ -522,11 +585,13 @@ class EnhancedHandlers:
             return
         
         target_user = message.reply_to_message.from_user
-        reason = message.text.split(maxsplit=1)[1] if len(message.text.split()) > 1 else "Promoted by admin"
+        parts = message.text.split(maxsplit=1)
+        reason = parts[1] if len(parts) > 1 else "Promoted by admin"
         
         success = await self.role_system.promote_user(
             message.chat.id, target_user.id, message.from_user.id, reason
         )
+        self._invalidate_member(message.chat.id, target_user.id)
         
         if success:
             await message.reply_text(f"✅ {format_user_mention(target_user)} has been promoted to trusted member.")
@@ -544,11 +609,13 @@ class EnhancedHandlers:
             return
         
         target_user = message.reply_to_message.from_user
-        reason = message.text.split(maxsplit=1)[1] if len(message.text.split()) > 1 else "Demoted by admin"
+        parts = message.text.split(maxsplit=1)
+        reason = parts[1] if len(parts) > 1 else "Demoted by admin"
         
         success = await self.role_system.demote_user(
             message.chat.id, target_user.id, message.from_user.id, reason
         )
+        self._invalidate_member(message.chat.id, target_user.id)
         
         if success:
             await message.reply_text(f"✅ {format_user_mention(target_user)} has been demoted to regular member.")
@@ -573,13 +640,14 @@ class EnhancedHandlers:
         reason = "Muted by admin"
         
         if args:
+            rest = " ".join(args[1:]) or reason
             try:
                 if args[0].endswith('h'):
                     duration_hours = int(args[0][:-1])
-                    reason = " ".join(args[1:]) if len(args) > 1 else reason
+                    reason = rest
                 elif args[0].endswith('d'):
                     duration_hours = int(args[0][:-1]) * 24
-                    reason = " ".join(args[1:]) if len(args) > 1 else reason
+                    reason = rest
                 else:
                     reason = " ".join(args)
             except:
@@ -588,6 +656,7 @@ class EnhancedHandlers:
         success = await self.role_system.mute_user(
             message.chat.id, target_user.id, message.from_user.id, duration_hours, reason
         )
+        self._invalidate_member(message.chat.id, target_user.id)
         
         if success:
             await message.reply_text(
@@ -612,6 +681,7 @@ class EnhancedHandlers:
         success = await self.role_system.unmute_user(
             message.chat.id, target_user.id, message.from_user.id
         )
+        self._invalidate_member(message.chat.id, target_user.id)
         
         if success:
             await message.reply_text(f"🔊 {format_user_mention(target_user)} has been unmuted.")
@@ -670,13 +740,31 @@ class EnhancedHandlers:
         
         await message.reply_text(settings_text)
     
-    async def _delete_after(self, chat_id: int, message_id: int, delay: int):
-        """Delete message after delay"""
-        await asyncio.sleep(delay)
+    def _spawn(self, coro: Coroutine) -> asyncio.Task:
+        """Run a coroutine in the background, keeping a reference until it finishes"""
+        task = asyncio.create_task(coro)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+    
+    async def _notify_and_delete(self, chat_id: int, text: str, ttl: Optional[int] = None):
+        """Send a notification and delete it after ttl seconds, if given"""
         try:
-            await self.client.delete_messages(chat_id, message_id)
-        except:
-            pass
+            notification = await self.client.send_message(chat_id, text)
+        except Exception as e:
+            self.logger.error(f"Error sending notification to {chat_id}: {e}")
+            return
+        
+        if ttl is not None:
+            self.deleter.delete_after(chat_id, notification.id, ttl)
+    
+    async def close(self):
+        """Write the group, user and violation rows still queued"""
+        await asyncio.gather(
+            self.group_writer.close(),
+            self.user_writer.close(),
+            self.bot_logger.close()
+        )
 
 
 def setup_enhanced_handlers(client: Client, db: Database):
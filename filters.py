@@ -16,6 +16,12 @@ class ContentFilter:
         self.config = config
         self.keywords = config.get_keywords()
         self.compiled_patterns = self._compile_patterns()
+        self.prefilter = self._compile_prefilter()
+        self.category_sizes = self._count_keywords()
+    
+    def _count_keywords(self) -> Dict[str, int]:
+        """Count keywords per category"""
+        return {category: len(keywords) for category, keywords in self.keywords.items()}
     
     def _compile_patterns(self) -> Dict[str, List[re.Pattern]]:
         """Compile keyword patterns for faster matching"""
@@ -30,6 +36,25 @@ class ContentFilter:
         
         return patterns
     
+    def _compile_prefilter(self) -> Optional[re.Pattern]:
+        """Compile every keyword into one alternation for a single-pass screen"""
+        keywords = {keyword.lower() for keywords in self.keywords.values() for keyword in keywords}
+        if not keywords:
+            return None
+        
+        # Longest first so a keyword is not shadowed by one of its prefixes
+        alternation = '|'.join(re.escape(k) for k in sorted(keywords, key=len, reverse=True))
+        return re.compile(rf'\b(?:{alternation})\b', re.IGNORECASE | re.UNICODE)
+    
+    def maybe_contains_banned(self, text: str) -> bool:
+        """Cheap screen: False means check_text_content would find nothing"""
+        if not text or self.prefilter is None:
+            return False
+        
+        # Search the lowercased text like check_text_content; lower() can move word
+        # boundaries (U+0130 becomes "i" plus a combining dot)
+        return self.prefilter.search(text.lower()) is not None
+    
     def check_text_content(self, text: str) -> Tuple[bool, List[str], List[str]]:
         """
         Check text content for banned keywords
@@ -190,6 +215,8 @@ class ContentFilter:
         """Update keyword list and recompile patterns"""
         self.keywords = new_keywords
         self.compiled_patterns = self._compile_patterns()
+        self.prefilter = self._compile_prefilter()
+        self.category_sizes = self._count_keywords()
         
         # Save to config
         try:
@@ -234,3 +261,11 @@ class ContentFilter:
     def get_keywords_by_category(self, category: str) -> List[str]:
         """Get keywords for a specific category"""
         return self.keywords.get(category, [])
+    
+    def get_category_sizes(self) -> Dict[str, int]:
+        """Get the number of keywords in each category"""
+        return self.category_sizes
+    
+    def get_category_snapshot(self) -> List[Tuple[str, int]]:
+        """Get (category, keyword count) pairs in a single call"""
+        return list(self.category_sizes.items())
@@ -12,7 +12,7 @@ from dataclasses import dataclass, asdict
 from pyrogram.client import Client
 from pyrogram.types import Message, User
 from database import Database
-from utils import safe_ban_user, format_user_mention
+from utils import DelayedDeleter, safe_ban_user, format_user_mention
 
 logger = logging.getLogger(__name__)
 
@@ -33,9 +33,11 @@ class GBanEntry:
 class GBanSystem:
     """Global ban management system"""
     
-    def __init__(self, client: Client, db: Database):
+    def __init__(self, client: Client, db: Database, deleter: Optional[DelayedDeleter] = None):
         self.client = client
         self.db = db
+        # Batched delayed deletion of notices, usually shared with the handlers
+        self.deleter = deleter or DelayedDeleter(client)
         self.gban_list: Dict[int, GBanEntry] = {}
         self.gban_admins: Set[int] = set()  # Users who can issue gbans
         self.subscribed_chats: Set[int] = set()  # Chats that enforce gbans
@@ -320,7 +322,7 @@ class GBanSystem:
                     )
                     
                     # Auto-delete notification after 30 seconds
-                    asyncio.create_task(self._delete_after(chat_id, notification.id, 30))
+                    self.deleter.delete_after(chat_id, notification.id, 30)
                     
                     # Log the enforcement
                     await self.db.log_moderation_action(
@@ -495,11 +497,3 @@ class GBanSystem:
         
         if expired_users:
             logger.info(f"Cleaned up {len(expired_users)} expired GBANs")
-    
-    async def _delete_after(self, chat_id: int, message_id: int, delay: int):
-        """Delete message after delay"""
-        await asyncio.sleep(delay)
-        try:
-            await self.client.delete_messages(chat_id, message_id)
-        except:
-            pass
\ No newline at end of file
@@ -37,22 +37,23 @@ def setup_handlers(app: Client, db: Database, bot_logger: BotLogger):
     async def handle_text_message(client: Client, message: Message):
         """Handle text messages in groups"""
         try:
-            # Add group and user to database
-            await db.add_group(message.chat.id, message.chat.title)
+            # Add group, check admin status and load settings concurrently
             user_info = get_user_info(message.from_user)
+            _, user_is_admin, settings = await asyncio.gather(
+                db.add_group(message.chat.id, message.chat.title),
+                is_admin(client, message.chat.id, user_info['id']),
+                db.get_group_settings(message.chat.id)
+            )
             await db.add_user(
                 user_info['id'], 
                 user_info['first_name'], 
                 user_info['last_name'], 
                 user_info['username'],
-                await is_admin(client, message.chat.id, user_info['id'])
+                user_is_admin
             )
             
-            # Get group settings
-            settings = await db.get_group_settings(message.chat.id)
-            
             # Check if user is admin (admins bypass filters)
-            if await is_admin(client, message.chat.id, message.from_user.id):
+            if user_is_admin:
                 return
             
             # Anti-flood check
@@ -62,7 +63,7 @@ def setup_handlers(app: Client, db: Database, bot_logger: BotLogger):
                     return
             
             # Text content filtering
-            if settings.get('text_filter_enabled', True):
+            if settings.get('text_filter_enabled', True) and content_filter.maybe_contains_banned(message.text):
                 is_banned, categories, keywords = content_filter.check_text_content(message.text)
                 
                 if is_banned:
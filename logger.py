@@ -6,7 +6,7 @@ import logging
 import asyncio
 from datetime import datetime, timedelta
 from typing import Optional, List, Dict
-from database import Database
+from database import BatchWriter, Database
 
 logger = logging.getLogger(__name__)
 
@@ -15,6 +15,7 @@ class BotLogger:
     
     def __init__(self, db: Database):
         self.db = db
+        self.violation_writer = BatchWriter(self.log_violations)
     
     async def log_violation(self, group_id: int, user_id: int, action: str, 
                            reason: str, original_message: str = None, 
@@ -35,6 +36,23 @@ class BotLogger:
         except Exception as e:
             logger.error(f"Failed to log violation: {e}")
     
+    def queue_violation(self, group_id: int, user_id: int, action: str, 
+                        reason: str, original_message: str = None, 
+                        message_id: int = None):
+        """Queue a moderation violation to be logged with the next batch"""
+        self.violation_writer.submit(
+            (group_id, user_id, action, reason, original_message, None, message_id)
+        )
+    
+    async def log_violations(self, rows: List[tuple]):
+        """Log a batch of queued violations"""
+        if await self.db.log_moderation_actions(rows):
+            logger.info(f"Violations logged: {len(rows)}")
+    
+    async def close(self):
+        """Write any violations still queued"""
+        await self.violation_writer.close()
+    
     async def log_edit(self, group_id: int, user_id: int, original_message: str,
                       edited_message: str, message_id: int):
         """Log message edit"""
@@ -118,7 +136,11 @@ class BotLogger:
     async def export_logs(self, group_id: int, days: int = 7) -> str:
         """Export logs to text format for appeals"""
         try:
-            logs = await self.db.get_moderation_logs(group_id, 10000)
+            # Fetch the logs and the summary concurrently
+            logs, summary = await asyncio.gather(
+                self.db.get_moderation_logs(group_id, 10000),
+                self.get_violation_summary(group_id, days * 24)
+            )
             
             # Filter logs by time
             cutoff_time = datetime.utcnow() - timedelta(days=days)
@@ -142,7 +164,6 @@ SUMMARY:
 """
             
             # Add summary
-            summary = await self.get_violation_summary(group_id, days * 24)
             for action, count in summary.get('violation_counts', {}).items():
                 export_text += f"{action}: {count}\n"
             
@@ -30,6 +30,7 @@ class TelegramProtectionBot:
         self.app = None
         self.db = None
         self.bot_logger = None
+        self.enhanced_handlers = None
         self.config = Config()
         
     async def initialize(self):
@@ -79,6 +80,12 @@ class TelegramProtectionBot:
         finally:
             if self.app:
                 await self.app.stop()
+            
+            # Drain queued log and upsert batches while the database is still open
+            if self.enhanced_handlers:
+                await self.enhanced_handlers.close()
+            if self.bot_logger:
+                await self.bot_logger.close()
             if self.db:
                 await self.db.close()
 
@@ -0,0 +1,47 @@
+"""
+Tests for link extraction in the anti-spam system
+"""
+
+import re
+import unittest
+
+try:
+    from anti_spam import _URL_EXTRACT_RE, AntiSpamSystem
+except ImportError as e:  # pyrogram and the other bot dependencies are not installed
+    raise unittest.SkipTest(f"anti_spam dependencies unavailable: {e}")
+
+# The link pattern _URL_EXTRACT_RE replaced; its matches must stay the same
+BASELINE_URL_RE = re.compile(r'http[s]?://\S+|www\.\S+')
+
+class UrlExtractTest(unittest.TestCase):
+    """_URL_EXTRACT_RE must find exactly the links the old findall found"""
+    
+    def assert_same_links(self, text: str):
+        found = [match.group() for match in _URL_EXTRACT_RE.finditer(text)]
+        self.assertEqual(found, BASELINE_URL_RE.findall(text), text)
+    
+    def test_bare_scheme_or_www_is_not_a_link(self):
+        for text in ('see http:// now', 'a www.', 'https://', 'www.', 'http:// www.'):
+            self.assert_same_links(text)
+            self.assertEqual(list(_URL_EXTRACT_RE.finditer(text)), [])
+    
+    def test_links_and_hosts(self):
+        text = 'go https://Example.com:8080/a?b=1 or www.test.org/x#y now'
+        self.assert_same_links(text)
+        hosts = [match.group('host') for match in _URL_EXTRACT_RE.finditer(text)]
+        self.assertEqual(hosts, ['Example.com:8080', 'www.test.org'])
+    
+    def test_edge_inputs_match_baseline(self):
+        for text in ('http:///x', 'www./x', 'hhttp://x', 'wwww.x', 'http://a http://',
+                     'xhttps://y.z', '', '   '):
+            self.assert_same_links(text)
+
+class CheckLinksTest(unittest.IsolatedAsyncioTestCase):
+    """_check_links must not count a bare scheme or www. as a link"""
+    
+    async def test_bare_scheme_adds_no_link_confidence(self):
+        system = AntiSpamSystem(None, None)
+        self.assertEqual(system._check_links('see http:// now and a www.'), (False, [], 0.0))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,9 +2,12 @@
 Utility functions for Telegram Protection Bot
 """
 
+import time
+import heapq
 import logging
 import asyncio
-from typing import Dict, Optional, List
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Optional, List, Tuple
 from pyrogram import Client
 from pyrogram.types import User, ChatMember
 from pyrogram.enums import ChatMemberStatus
@@ -12,6 +15,11 @@ from pyrogram.errors import UserNotParticipant, ChatAdminRequired
 
 logger = logging.getLogger(__name__)
 
+# Queued message deletions are flushed per chat after this delay, in
+# batches no larger than Telegram's per-call limit
+DELETE_BATCH_DELAY = 0.5
+DELETE_BATCH_SIZE = 100
+
 async def is_admin(client: Client, chat_id: int, user_id: int) -> bool:
     """Check if user is admin in the chat"""
     try:
@@ -100,6 +108,71 @@ async def safe_ban_user(client: Client, chat_id: int, user_id: int,
         logger.error(f"Failed to ban user {user_id}: {e}")
         return False
 
+class DelayedDeleter:
+    """Delete messages now or after a delay, batched into one call per chat"""
+    
+    def __init__(self, client: Client, batch_delay: float = DELETE_BATCH_DELAY,
+                 throttle: Optional[Callable[[], Awaitable[None]]] = None):
+        self.client = client
+        self.batch_delay = batch_delay
+        self.throttle = throttle
+        
+        # (deadline, chat_id, message_id) min-heap of delayed deletions
+        self.heap: List[Tuple[float, int, int]] = []
+        self.timer_task: Optional[asyncio.Task] = None
+        
+        # chat_id: message ids waiting for the next batched delete
+        self.pending: Dict[int, List[int]] = defaultdict(list)
+        self.flush_task: Optional[asyncio.Task] = None
+    
+    def delete_after(self, chat_id: int, message_id: int, delay: float):
+        """Delete message after delay"""
+        entry = (time.monotonic() + delay, chat_id, message_id)
+        heapq.heappush(self.heap, entry)
+        
+        # Restart the timer if it is idle or now sleeping past the earliest deadline
+        timer = self.timer_task
+        if timer is not None and not timer.done():
+            if self.heap[0] is not entry:
+                return
+            timer.cancel()
+        self.timer_task = asyncio.create_task(self._release_due())
+    
+    async def _release_due(self):
+        """Hand delayed deletions to the batch queue as their deadlines pass"""
+        while self.heap:
+            delay = self.heap[0][0] - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            
+            _, chat_id, message_id = heapq.heappop(self.heap)
+            self.delete(chat_id, message_id)
+    
+    def delete(self, chat_id: int, message_id: int):
+        """Queue a message for the next batched delete in its chat"""
+        self.pending[chat_id].append(message_id)
+        
+        if self.flush_task is None or self.flush_task.done():
+            self.flush_task = asyncio.create_task(self._flush())
+    
+    async def _flush(self):
+        """Delete queued messages with one call per chat and batch"""
+        while self.pending:
+            await asyncio.sleep(self.batch_delay)
+            
+            pending, self.pending = self.pending, defaultdict(list)
+            for chat_id, message_ids in pending.items():
+                for i in range(0, len(message_ids), DELETE_BATCH_SIZE):
+                    try:
+                        if self.throttle is not None:
+                            await self.throttle()
+                        await self.client.delete_messages(
+                            chat_id, message_ids[i:i + DELETE_BATCH_SIZE]
+                        )
+                    except Exception as e:
+                        logger.error(f"Failed to delete messages in {chat_id}: {e}")
+
 def format_duration(seconds: int) -> str:
     """Format duration in seconds to human readable format"""
     if seconds < 60: